@@ -1,11 +1,12 @@
-from base58 import b58encode
+from typing import Tuple
 
-from hdtools import bech32
+from hdtools.base58check import b58decode, encode_check, checksum
+
+from hdtools import bech32_fast as bech32
 from hdtools.keys import PublicKey
 from hdtools.crypto_utils import hash160
 from hdtools.network import get_network_attr
 from hdtools.script import witness_byte, push
-from hdtools.crypto_utils import sha256
 from hdtools.opcodes import AddressType
 
 
@@ -18,9 +19,50 @@ def legacy_address(public_key: PublicKey, version_byte: bytes) -> str:
 
 
 def hashed_payload_to_address(payload) -> str:
-    checksum = sha256(sha256(payload))[:4]
-    address = payload + checksum
-    return b58encode(address).decode()
+    return encode_check(payload)
+
+
+def p2wpkh_p2sh_script(public_key: PublicKey) -> bytes:
+    """https://github.com/bitcoin/bips/blob/master/bip-0141.mediawiki#p2wpkh-nested-in-bip16-p2sh"""
+    return p2wpkh_p2sh_script_from_hash(hash160(public_key.encode(compressed=True)))
+
+
+def p2wpkh_p2sh_script_from_hash(key_hash: bytes) -> bytes:
+    """Same as p2wpkh_p2sh_script given the hash160 of the compressed public key"""
+    return witness_byte(witver=0) + push(key_hash)
+
+
+def address_to_hash(address: str, network='btc') -> Tuple[AddressType, bytes]:
+    """
+    Decode an address into its type and 20-byte hash: P2PKH (key hash), P2SH (script hash,
+    which covers P2WPKH-P2SH) or P2WPKH (witness program)
+    """
+    hrp = get_network_attr('hrp', network)
+    if address.lower().startswith(hrp + '1'):
+        witver, witprog = bech32.decode(hrp, address)
+        assert witver == 0 and len(witprog) == 20, 'Only P2WPKH segwit addresses are supported'
+        return AddressType.P2WPKH, witprog
+
+    bts = b58decode(address)
+    assert len(bts) == 25, f'Invalid address length {len(bts)}'
+    payload, check = bts[:-4], bts[-4:]
+    assert checksum(payload) == check, 'Invalid checksum'
+    version, hashed = payload[:1], payload[1:]
+    if version == get_network_attr('keyhash', network):
+        return AddressType.P2PKH, hashed
+    assert version == get_network_attr('scripthash', network), 'Invalid version byte'
+    return AddressType.P2SH, hashed
+
+
+def hash_to_address(key_hash: bytes, address_type='P2PKH', network='btc') -> str:
+    """Address of a compressed public key given its hash160, see address_to_hash"""
+    address_type = AddressType(address_type)
+    if address_type == AddressType.P2PKH:
+        return encode_check(get_network_attr('keyhash', network) + key_hash)
+    elif address_type == AddressType.P2WPKH_P2SH:
+        return encode_check(get_network_attr('scripthash', network) + hash160(p2wpkh_p2sh_script_from_hash(key_hash)))
+    assert address_type == AddressType.P2WPKH, f'Cannot render {address_type.value} addresses from a key hash'
+    return bech32.encode(get_network_attr('hrp', network), 0, key_hash)
 
 
 def pubkey_to_bech32(public_key: PublicKey, witver: int) -> str:
@@ -43,7 +85,7 @@ class Address:
     @staticmethod
     def to_p2wpkh_p2sh(public_key: PublicKey) -> 'str':
         return legacy_address(
-            witness_byte(witver=0) + push(hash160(public_key.encode(compressed=True))),
+            p2wpkh_p2sh_script(public_key),
             version_byte=get_network_attr('scripthash', public_key.network)
         )
 
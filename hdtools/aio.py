@@ -0,0 +1,213 @@
+"""
+asyncio front end for child derivation, address rendering and extended key decoding
+
+The CPU work runs in an executor, never on the event loop: the loop's default thread pool unless one is
+given (pass a ProcessPoolExecutor to use several cores, keys and results are pickled to and from the
+workers). Requests go through a bounded queue: when max_pending requests are waiting, callers are
+suspended until there is room again. Each dispatcher takes every request waiting in the queue (up to
+max_batch) at once, and the requests for children of the same parent are served by a single bulk
+derivation (XPub.derive_many), duplicate indexes are only derived once.
+
+    >>> async with Deriver(ProcessPoolExecutor(4)) as deriver:
+    ...     addresses = await asyncio.gather(*(deriver.address(xpub, i) for i in range(100)))
+
+Large ranges are split into chunks of chunk_size indexes so they are spread over the workers and
+do not hold up other requests. An error only fails the request that caused it.
+"""
+import asyncio
+import os
+import weakref
+from concurrent.futures import Executor
+from typing import Callable, Hashable, List, Optional
+
+from hdtools.extended_keys import ExtendedKey
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _children(parent: ExtendedKey, indexes: List[int], _) -> list:
+    return parent.derive_many(indexes)
+
+
+def _addresses(parent: ExtendedKey, indexes: List[int], address_type: Optional[str]) -> List[str]:
+    return [child.address(address_type) for child in parent.derive_many(indexes)]
+
+
+def _range(parent: ExtendedKey, ranges: List[tuple], _) -> list:
+    return [parent.derive_range(start, count) for start, count in ranges]
+
+
+def _address_range(parent: ExtendedKey, ranges: List[tuple], address_type: Optional[str]) -> list:
+    return [parent.address_range(start, count, address_type) for start, count in ranges]
+
+
+def _decode(_, strings: list, network: Optional[str]) -> List[ExtendedKey]:
+    return [ExtendedKey.decode(string, network) for string in strings]
+
+
+def _run(func: Callable, parent: Optional[ExtendedKey], items: list, arg) -> list:
+    """func over all items in one call, item by item if that fails so every error stays with its item"""
+    try:
+        return func(parent, items, arg)
+    except Exception as e:
+        if len(items) == 1:
+            return [e]
+    results = []
+    for item in items:
+        try:
+            results.extend(func(parent, [item], arg))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _parent_key(xkey: ExtendedKey) -> tuple:
+    """
+    Requests for children of the same node are coalesced and all derived from the first request's key, so
+    the node is identified by its full serialization (key, chain code, network, address type...) and path
+    """
+    return xkey.serialize(), xkey.path
+
+
+class Deriver:
+    def __init__(self, executor: Executor = None, workers=None, max_pending=1024, max_batch=4096,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        executor: where the work runs, the event loop's default executor if None
+        workers: number of jobs submitted to the executor at the same time (defaults to the CPU count)
+        """
+        assert max_pending > 0 and max_batch > 0 and chunk_size > 0, 'Sizes must be positive'
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.jobs = 0
+        self._queue = None  # type: Optional[asyncio.Queue]
+        self._dispatchers = []  # type: List[asyncio.Task]
+
+    async def __aenter__(self) -> 'Deriver':
+        self._start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_pending)
+            self._dispatchers = [asyncio.ensure_future(self._dispatch()) for _ in range(self.workers)]
+
+    async def close(self):
+        """Wait for the queued requests and stop the dispatchers, the executor is left running"""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for dispatcher in self._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._queue, self._dispatchers = None, []
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'jobs': self.jobs, 'pending': self._queue.qsize() if self._queue else 0}
+
+    async def _submit(self, group: Hashable, func: Callable, parent: Optional[ExtendedKey], item, arg=None):
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        self.requests += 1
+        await self._queue.put((group, func, parent, item, arg, future))  # waits while the queue is full
+        return await future
+
+    async def _dispatch(self):
+        queue = self._queue
+        while True:
+            requests = [await queue.get()]
+            while len(requests) < self.max_batch and not queue.empty():
+                requests.append(queue.get_nowait())
+            groups = {}
+            for request in requests:
+                groups.setdefault(request[0], []).append(request)
+            try:
+                await asyncio.gather(*(self._execute(group) for group in groups.values()))
+            finally:
+                for _ in requests:
+                    queue.task_done()
+
+    async def _execute(self, requests: list):
+        _, func, parent, _, arg, _ = requests[0]
+        items = list(dict.fromkeys(request[3] for request in requests))
+        self.jobs += 1
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, _run, func, parent, items, arg)
+            results = dict(zip(items, results))
+        except Exception as e:  # e.g. the executor is shut down or a result could not be pickled
+            results = dict.fromkeys(items, e)
+        for _, _, _, item, _, future in requests:
+            if future.done():  # cancelled by the caller
+                continue
+            if isinstance(results[item], Exception):
+                future.set_exception(results[item])
+            else:
+                future.set_result(results[item])
+
+    async def child(self, xkey: ExtendedKey, i: int) -> ExtendedKey:
+        return await self._submit(('child', _parent_key(xkey)), _children, xkey, i)
+
+    async def address(self, xkey: ExtendedKey, i: int, address_type=None) -> str:
+        return await self._submit(('address', _parent_key(xkey), address_type), _addresses, xkey, i, address_type)
+
+    async def _chunks(self, func: Callable, xkey: ExtendedKey, start: int, count: int, arg=None) -> list:
+        xkey._check_range(start, count)
+        parent = _parent_key(xkey)
+        chunks = await asyncio.gather(*(
+            self._submit((func.__name__, parent, s, arg), func, xkey, (s, min(self.chunk_size, start + count - s)), arg)
+            for s in range(start, start + count, self.chunk_size)
+        ))
+        return [result for chunk in chunks for result in chunk]
+
+    async def derive_range(self, xkey: ExtendedKey, start: int, count: int) -> List[ExtendedKey]:
+        return await self._chunks(_range, xkey, start, count)
+
+    async def address_range(self, xkey: ExtendedKey, start: int, count: int, address_type=None) -> List[str]:
+        return await self._chunks(_address_range, xkey, start, count, address_type)
+
+    async def decode(self, string, network=None) -> ExtendedKey:
+        """ExtendedKey.decode, any known network unless network is given"""
+        return await self._submit(('decode', network), _decode, None, string, network)
+
+
+_defaults = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+
+def default_deriver() -> Deriver:
+    """A Deriver with default settings, one per event loop"""
+    loop = asyncio.get_running_loop()
+    deriver = _defaults.get(loop)
+    if deriver is None:
+        deriver = _defaults[loop] = Deriver()
+        deriver._start()
+        # the dispatchers hold the loop, so the weak key alone would never be released: forget the deriver
+        # once they stop, when it is closed or when asyncio.run cancels the remaining tasks at shutdown
+        deriver._dispatchers[0].add_done_callback(lambda _: _defaults.pop(loop, None))
+    return deriver
+
+
+async def child(xkey: ExtendedKey, i: int) -> ExtendedKey:
+    return await default_deriver().child(xkey, i)
+
+
+async def derive_range(xkey: ExtendedKey, start: int, count: int) -> List[ExtendedKey]:
+    return await default_deriver().derive_range(xkey, start, count)
+
+
+async def address(xkey: ExtendedKey, i: int, address_type=None) -> str:
+    return await default_deriver().address(xkey, i, address_type)
+
+
+async def address_range(xkey: ExtendedKey, start: int, count: int, address_type=None) -> List[str]:
+    return await default_deriver().address_range(xkey, start, count, address_type)
+
+
+async def decode(string, network=None) -> ExtendedKey:
+    return await default_deriver().decode(string, network)
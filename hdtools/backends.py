@@ -0,0 +1,319 @@
+"""
+Pluggable elliptic curve backends
+Every backend works on affine (x, y) integer tuples and provides scalar*G, point + scalar*G,
+decompression, ECDSA sign / verify and hash160. Available backends:
+    * python: pure Python arithmetic from hdtools.secp256k1
+    * ecdsa: the ecdsa package, kept as the reference implementation
+    * libsecp256k1: bitcoin-core's libsecp256k1 through coincurve, used by default when installed
+
+The backend is chosen by set_backend(name), the HDTOOLS_BACKEND environment variable, or else the
+available backend with the highest priority, for the whole process. using(name) switches backends only for
+the current thread or asyncio task. Backends are only loaded (and their dependencies imported)
+on first use. Other backends plug in through register().
+"""
+import contextvars
+import hashlib
+import os
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from hdtools import secp256k1
+from hdtools.nt_utils import mulinv
+from hdtools.signature import encode_der, normalize_s
+
+Affine = Tuple[int, int]
+
+ENV_VARIABLE = 'HDTOOLS_BACKEND'
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class Backend:
+    name = NotImplemented
+
+    def mul_base(self, k: int) -> Affine:
+        raise NotImplementedError
+
+    def tweak_add(self, point: Affine, k: int) -> Optional[Affine]:
+        """point + k*G, None for the point at infinity"""
+        raise NotImplementedError
+
+    def tweak_add_many(self, point: Affine, scalars: Iterable[int]) -> List[Optional[Affine]]:
+        return [self.tweak_add(point, k) for k in scalars]
+
+    def decompress(self, x: int, odd: bool) -> Optional[Affine]:
+        """Point with the given x and y parity, None if x is not on the curve"""
+        raise NotImplementedError
+
+    def sign(self, secret: int, digest: bytes) -> Tuple[int, int]:
+        """Deterministic (RFC6979) low-S ECDSA signature of a 32-byte digest"""
+        raise NotImplementedError
+
+    def sign_many(self, secret: int, digests: Iterable[bytes]) -> List[Tuple[int, int]]:
+        return [self.sign(secret, digest) for digest in digests]
+
+    def sign_recoverable(self, secret: int, digest: bytes) -> Tuple[int, int, int]:
+        """Same signature as sign with its recovery id, see secp256k1.sign_recoverable"""
+        r, s = self.sign(secret, digest)
+        public = self.mul_base(secret)
+        for recid in range(4):
+            if self.recover(digest, r, s, recid) == public:
+                return r, s, recid
+        raise ValueError('No recovery id matches the signature')
+
+    def recover(self, digest: bytes, r: int, s: int, recid: int) -> Optional[Affine]:
+        """Public key of a recoverable signature, None if there is none"""
+        raise NotImplementedError
+
+    def verify(self, point: Affine, digest: bytes, r: int, s: int) -> bool:
+        raise NotImplementedError
+
+    def hash160(self, bts: bytes) -> bytes:
+        return hashlib.new('ripemd160', hashlib.sha256(bts).digest()).digest()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+
+class PythonBackend(Backend):
+    name = 'python'
+
+    def mul_base(self, k):
+        return secp256k1.to_affine(secp256k1.mul_base(k))
+
+    def tweak_add(self, point, k):
+        return secp256k1.tweak_add(point, k)
+
+    def tweak_add_many(self, point, scalars):
+        return secp256k1.tweak_add_many(point, scalars)
+
+    def decompress(self, x, odd):
+        return secp256k1.decompress(x, odd)
+
+    def sign(self, secret, digest):
+        return secp256k1.sign(secret, digest)
+
+    def sign_many(self, secret, digests):
+        return secp256k1.sign_many(secret, digests)
+
+    def sign_recoverable(self, secret, digest):
+        return secp256k1.sign_recoverable(secret, digest)
+
+    def recover(self, digest, r, s, recid):
+        return secp256k1.recover(digest, r, s, recid)
+
+    def verify(self, point, digest, r, s):
+        return secp256k1.verify(point, digest, r, s)
+
+
+class EcdsaBackend(Backend):
+    name = 'ecdsa'
+
+    def __init__(self):
+        import ecdsa
+        from ecdsa.ellipticcurve import Point
+        from ecdsa.util import sigdecode_string, sigencode_strings
+        self.ecdsa = ecdsa
+        self.curve = ecdsa.SECP256k1
+        self.Point = Point
+        self.sigencode = sigencode_strings
+        self.sigdecode = sigdecode_string
+
+    def mul_base(self, k):
+        point = self.curve.generator * k
+        return point.x(), point.y()
+
+    def tweak_add(self, point, k):
+        result = self.curve.generator * k + self.Point(self.curve.curve, *point)
+        if result == self.ecdsa.ellipticcurve.INFINITY:
+            return None
+        return result.x(), result.y()
+
+    def decompress(self, x, odd):
+        try:
+            key = self.ecdsa.VerifyingKey.from_string(
+                bytes([3 if odd else 2]) + x.to_bytes(32, 'big'), curve=self.curve
+            )
+        except (self.ecdsa.MalformedPointError, OverflowError, AssertionError):
+            return None
+        return key.pubkey.point.x(), key.pubkey.point.y()
+
+    def sign(self, secret, digest):
+        return self.sign_many(secret, [digest])[0]
+
+    def sign_many(self, secret, digests):
+        key = self.ecdsa.SigningKey.from_secret_exponent(secret, curve=self.curve)
+        signatures = []
+        for digest in digests:
+            r, s = key.sign_digest_deterministic(digest, hashfunc=hashlib.sha256, sigencode=self.sigencode)
+            signatures.append((int.from_bytes(r, 'big'), normalize_s(int.from_bytes(s, 'big'))))
+        return signatures
+
+    def recover(self, digest, r, s, recid):
+        if not (0 < r < secp256k1.N and 0 < s < secp256k1.N and 0 <= recid < 4):
+            return None
+        point = self.decompress(r + secp256k1.N if recid & 2 else r, bool(recid & 1))
+        if point is None:
+            return None
+        w = mulinv(r, secp256k1.N)
+        e = int.from_bytes(digest, 'big')
+        result = self.Point(self.curve.curve, *point) * (s * w % secp256k1.N) + \
+            self.curve.generator * (-e * w % secp256k1.N)
+        if result == self.ecdsa.ellipticcurve.INFINITY:
+            return None
+        return result.x(), result.y()
+
+    def verify(self, point, digest, r, s):
+        if not (0 < r < secp256k1.N and 0 < s < secp256k1.N):
+            return False
+        key = self.ecdsa.VerifyingKey.from_public_point(self.Point(self.curve.curve, *point), curve=self.curve)
+        signature = r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+        try:
+            return key.verify_digest(signature, digest, sigdecode=self.sigdecode)
+        except self.ecdsa.BadSignatureError:
+            return False
+
+
+class LibSecp256k1Backend(Backend):
+    name = 'libsecp256k1'
+
+    def __init__(self):
+        try:
+            import coincurve
+        except ImportError as e:
+            raise BackendUnavailable('coincurve is not installed') from e
+        self.coincurve = coincurve
+
+    def _public(self, point):
+        return self.coincurve.PublicKey.from_point(*point)
+
+    def mul_base(self, k):
+        return self.coincurve.PublicKey.from_valid_secret(k.to_bytes(32, 'big')).point()
+
+    def tweak_add(self, point, k):
+        k %= secp256k1.N
+        if not k:
+            return point
+        try:
+            return self._public(point).add(k.to_bytes(32, 'big')).point()
+        except ValueError:  # the result is the point at infinity
+            return None
+
+    def decompress(self, x, odd):
+        if not 0 <= x < secp256k1.P:
+            return None
+        try:
+            return self.coincurve.PublicKey(bytes([3 if odd else 2]) + x.to_bytes(32, 'big')).point()
+        except ValueError:
+            return None
+
+    def sign(self, secret, digest):
+        return self.sign_recoverable(secret, digest)[:2]
+
+    def sign_recoverable(self, secret, digest):
+        compact = self.coincurve.PrivateKey(secret.to_bytes(32, 'big')).sign_recoverable(digest, hasher=None)
+        return int.from_bytes(compact[:32], 'big'), int.from_bytes(compact[32:64], 'big'), compact[64]
+
+    def recover(self, digest, r, s, recid):
+        if not (0 < r < secp256k1.N and 0 < s < secp256k1.N and 0 <= recid < 4):
+            return None
+        signature = r.to_bytes(32, 'big') + s.to_bytes(32, 'big') + bytes([recid])
+        try:
+            return self.coincurve.PublicKey.from_signature_and_message(signature, digest, hasher=None).point()
+        except ValueError:
+            return None
+
+    def sign_many(self, secret, digests):
+        key = self.coincurve.PrivateKey(secret.to_bytes(32, 'big'))
+        signatures = []
+        for digest in digests:
+            compact = key.sign_recoverable(digest, hasher=None)
+            signatures.append((int.from_bytes(compact[:32], 'big'), int.from_bytes(compact[32:64], 'big')))
+        return signatures
+
+    def verify(self, point, digest, r, s):
+        if not (0 < r < secp256k1.N and 0 < s < secp256k1.N):
+            return False
+        # libsecp256k1 only accepts low-S signatures, both forms are valid ECDSA
+        return self._public(point).verify(encode_der(r, normalize_s(s)), digest, hasher=None)
+
+
+_registry = {}  # type: Dict[str, Tuple[Callable[[], Backend], int]]
+_instances = {}  # type: Dict[str, Backend]
+_current = None  # type: Optional[Backend]
+_override = contextvars.ContextVar('hdtools_backend', default=None)  # set by using()
+
+
+def register(name: str, factory: Callable[[], Backend], priority=0):
+    """
+    Register a backend factory, it is called once on first use and may raise BackendUnavailable (or ImportError)
+    Without an explicit choice the available backend with the highest priority is used
+    """
+    _registry[name] = (factory, priority)
+    _instances.pop(name, None)
+
+
+def get_backend(name: str) -> Backend:
+    if name not in _instances:
+        assert name in _registry, f'Unknown backend {name!r}, expected one of {sorted(_registry)}'
+        try:
+            _instances[name] = _registry[name][0]()
+        except ImportError as e:
+            raise BackendUnavailable(f'Backend {name!r} is not available: {e}') from e
+    return _instances[name]
+
+
+def available_backends() -> List[str]:
+    """Names of the backends that can be loaded, fastest (highest priority) first"""
+    names = []
+    for name in sorted(_registry, key=lambda name: -_registry[name][1]):
+        try:
+            get_backend(name)
+        except BackendUnavailable:
+            continue
+        names.append(name)
+    return names
+
+
+def set_backend(name: Optional[str]):
+    """Select a backend by name, None goes back to the default choice"""
+    global _current
+    _current = None if name is None else get_backend(name)
+
+
+def current() -> Backend:
+    """The selected backend, only the backends tried before it are loaded"""
+    global _current
+    override = _override.get()
+    if override is not None:
+        return override
+    if _current is None:
+        name = os.environ.get(ENV_VARIABLE)
+        if name:
+            _current = get_backend(name)
+        else:
+            for name in sorted(_registry, key=lambda name: -_registry[name][1]):
+                try:
+                    _current = get_backend(name)
+                    break
+                except BackendUnavailable:
+                    continue
+            assert _current is not None, 'No backend is available'
+    return _current
+
+
+@contextmanager
+def using(name: str):
+    """Temporarily switch to another backend, other threads and asyncio tasks keep theirs"""
+    token = _override.set(get_backend(name))
+    try:
+        yield _override.get()
+    finally:
+        _override.reset(token)
+
+
+register(EcdsaBackend.name, EcdsaBackend, priority=0)
+register(PythonBackend.name, PythonBackend, priority=10)
+register(LibSecp256k1Backend.name, LibSecp256k1Backend, priority=20)
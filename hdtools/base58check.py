@@ -0,0 +1,127 @@
+"""
+Base58 and Base58Check encoding
+References:
+    https://en.bitcoin.it/wiki/Base58Check_encoding
+
+Instead of one big-int division per character, numbers are split into 10-character chunks
+(one big-int divmod by 58^10 each) and every chunk is converted with small-int arithmetic through
+a 2-character table. Strings are always returned as str, payloads as bytes.
+"""
+from functools import lru_cache
+from typing import Iterable, List, Optional, Union
+
+from hdtools.crypto_utils import sha256
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+CHUNK = 10
+CHUNK_BASE = 58 ** CHUNK
+PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+DIGITS = {char: value for value, char in enumerate(ALPHABET)}
+
+ADDRESS_LENGTH = 25  # version byte + hash160 + checksum
+XKEY_LENGTH = 82  # serialized extended key + checksum
+
+
+class Base58DecodeError(Exception):
+    pass
+
+
+def _chunk_to_str(value: int) -> str:
+    pairs = PAIRS
+    value, d4 = divmod(value, 3364)
+    value, d3 = divmod(value, 3364)
+    value, d2 = divmod(value, 3364)
+    d0, d1 = divmod(value, 3364)
+    return pairs[d0] + pairs[d1] + pairs[d2] + pairs[d3] + pairs[d4]
+
+
+def b58encode(data: bytes) -> str:
+    n = int.from_bytes(data, 'big')
+    chunks = []
+    while n:
+        n, chunk = divmod(n, CHUNK_BASE)
+        chunks.append(_chunk_to_str(chunk))
+    encoded = ''.join(reversed(chunks)).lstrip('1')
+    return '1' * (len(data) - len(data.lstrip(b'\x00'))) + encoded
+
+
+def b58decode(string: Union[str, bytes], length: Optional[int] = None) -> bytes:
+    """Decode a Base58 string, if length is given the result must be exactly length bytes"""
+    if isinstance(string, bytes):
+        try:
+            string = string.decode('ascii')
+        except UnicodeDecodeError:
+            raise Base58DecodeError('Non-ASCII input')
+    stripped = string.lstrip('1')
+    zeros = len(string) - len(stripped)
+
+    digits = DIGITS
+    n = 0
+    try:
+        head = len(stripped) % CHUNK or CHUNK
+        for start, end in [(0, head)] + [(i, i + CHUNK) for i in range(head, len(stripped), CHUNK)]:
+            value = 0
+            for char in stripped[start:end]:
+                value = value * 58 + digits[char]
+            n = n * CHUNK_BASE + value if start else value
+    except KeyError as e:
+        raise Base58DecodeError(f'Invalid character {e.args[0]!r}')
+
+    body = n.to_bytes((n.bit_length() + 7) // 8, 'big') if n else b''
+    decoded = b'\x00' * zeros + body
+    if length is not None and len(decoded) != length:
+        raise Base58DecodeError(f'Invalid length {len(decoded)}, expected {length}')
+    return decoded
+
+
+def checksum(payload: bytes) -> bytes:
+    return sha256(sha256(payload))[:4]
+
+
+def encode_check(payload: bytes) -> str:
+    return b58encode(payload + checksum(payload))
+
+
+def decode_check(string: Union[str, bytes], length: Optional[int] = None) -> bytes:
+    """
+    Decode a Base58Check string and return the payload without its checksum
+    length, if given, is the expected length including the 4-byte checksum (25 for addresses, 82 for xkeys);
+    strings that cannot have that length are rejected before decoding
+    """
+    if length is not None and not length <= len(string) <= max_chars(length):
+        raise Base58DecodeError(f'Invalid string length {len(string)} for a {length}-byte payload')
+    bts = b58decode(string, length)
+    if len(bts) < 4:
+        raise Base58DecodeError('Too short')
+    payload, check = bts[:-4], bts[-4:]
+    if checksum(payload) != check:
+        raise Base58DecodeError('Invalid checksum')
+    return payload
+
+
+@lru_cache(maxsize=None)
+def max_chars(length: int) -> int:
+    """Upper bound on the encoded length of length bytes (the lower bound is length itself)"""
+    return len(b58encode(b'\xff' * length))
+
+
+def encode_check_many(payloads: Iterable[bytes]) -> List[str]:
+    return [encode_check(payload) for payload in payloads]
+
+
+def decode_check_many(strings: Iterable[Union[str, bytes]], length: Optional[int] = None) -> List[bytes]:
+    return [decode_check(string, length) for string in strings]
+
+
+def validate_many(strings: Iterable[Union[str, bytes]], length: Optional[int] = None) -> List[bool]:
+    """Per-string Base58Check validity (characters, optional length and checksum)"""
+    results = []
+    for string in strings:
+        try:
+            decode_check(string, length)
+        except Base58DecodeError:
+            results.append(False)
+        else:
+            results.append(True)
+    return results
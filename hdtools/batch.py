@@ -0,0 +1,180 @@
+"""
+Struct-of-arrays container for large numbers of derived addresses
+
+An AddressBatch keeps the children of one extended public key in three flat buffers instead of one
+XPub (with its PublicKey, path string and address type) per child:
+    indexes:     array('I') of child numbers
+    public_keys: compressed public keys, 33 bytes each
+    hashes:      hash160 of the compressed public keys, 20 bytes each
+that is 57 bytes per child. Addresses are only rendered on access. Slices share the buffers of the batch
+they are taken from and the buffers are exposed as memoryviews.
+
+Serialized layout (write / from_buffer):
+    header: b'HDAB', version (u8), then the lengths (u8) of the address type, network and parent path,
+            the three strings, NUL padding to a multiple of 4 and count (u32, little endian)
+    then the indexes (u32, little endian), the public keys and the hashes
+from_buffer wraps any bytes-like object (bytes, bytearray, mmap) without copying the buffers.
+"""
+import io
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterator, List, Union
+
+from hdtools.address import hash_to_address
+from hdtools.opcodes import AddressType
+
+KEY_SIZE = 33
+HASH_SIZE = 20
+MAGIC = b'HDAB'
+VERSION = 1
+
+assert array('I').itemsize == 4, 'array("I") must hold 32-bit integers'
+
+
+class AddressBatch:
+    __slots__ = ('address_type', 'network', 'path', '_indexes', '_keys', '_hashes', '_start', '_stop')
+
+    def __init__(self, indexes, public_keys, hashes, address_type='P2PKH', network='btc', path=None):
+        """
+        indexes is an array('I') (or a memoryview of format 'I'), public_keys and hashes are bytes-like
+        path is the path of the parent key, e.g. M/84h/0h/0h/0
+        """
+        count = len(indexes)
+        assert len(public_keys) == count * KEY_SIZE, 'public_keys must hold 33 bytes per index'
+        assert len(hashes) == count * HASH_SIZE, 'hashes must hold 20 bytes per index'
+        self.address_type = AddressType(address_type).value
+        self.network = network
+        self.path = path
+        self._indexes = indexes
+        self._keys = public_keys
+        self._hashes = hashes
+        self._start, self._stop = 0, count
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(path={self.path}, count={len(self)}, address_type={self.address_type})'
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[str, 'AddressBatch']:
+        """Address at a position, or a batch sharing the buffers of this one for a slice"""
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                return self._view(self._start + start, self._start + max(start, stop))
+            positions = range(start, stop, step)
+            return AddressBatch(
+                array('I', [self.indexes[i] for i in positions]),
+                b''.join(self.public_key(i) for i in positions),
+                b''.join(self.hash160(i) for i in positions),
+                self.address_type, self.network, self.path
+            )
+        return self.address(item)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.address(i)
+
+    def _view(self, start: int, stop: int) -> 'AddressBatch':
+        view = object.__new__(AddressBatch)
+        view.address_type, view.network, view.path = self.address_type, self.network, self.path
+        view._indexes, view._keys, view._hashes = self._indexes, self._keys, self._hashes
+        view._start, view._stop = start, stop
+        return view
+
+    def _position(self, i: int) -> int:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('AddressBatch index out of range')
+        return self._start + i
+
+    @property
+    def indexes(self) -> memoryview:
+        return memoryview(self._indexes)[self._start:self._stop]
+
+    @property
+    def public_keys(self) -> memoryview:
+        return memoryview(self._keys)[self._start * KEY_SIZE:self._stop * KEY_SIZE]
+
+    @property
+    def hashes(self) -> memoryview:
+        return memoryview(self._hashes)[self._start * HASH_SIZE:self._stop * HASH_SIZE]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self) * (4 + KEY_SIZE + HASH_SIZE)
+
+    def index(self, i: int) -> int:
+        """Child number at position i"""
+        return self._indexes[self._position(i)]
+
+    def public_key(self, i: int) -> bytes:
+        position = self._position(i) * KEY_SIZE
+        return bytes(self._keys[position:position + KEY_SIZE])
+
+    def hash160(self, i: int) -> bytes:
+        position = self._position(i) * HASH_SIZE
+        return bytes(self._hashes[position:position + HASH_SIZE])
+
+    def address(self, i: int, address_type=None) -> str:
+        return hash_to_address(self.hash160(i), address_type or self.address_type, self.network)
+
+    def addresses(self, address_type=None) -> List[str]:
+        address_type = address_type or self.address_type
+        hashes = self.hashes
+        return [hash_to_address(bytes(hashes[offset:offset + HASH_SIZE]), address_type, self.network)
+                for offset in range(0, len(hashes), HASH_SIZE)]
+
+    def _header(self) -> bytes:
+        strings = [self.address_type.encode(), self.network.encode(), (self.path or '').encode()]
+        header = MAGIC + struct.pack('<BBBB', VERSION, *map(len, strings)) + b''.join(strings)
+        return header + bytes(-len(header) % 4) + struct.pack('<I', len(self))
+
+    def write(self, fp: BinaryIO) -> int:
+        """Write the batch to a binary file, the buffers are written without copying, returns the size"""
+        indexes = self.indexes
+        if sys.byteorder != 'little':
+            indexes = array('I', indexes)
+            indexes.byteswap()
+        size = 0
+        for part in (self._header(), indexes, self.public_keys, self.hashes):
+            fp.write(part)
+            size += memoryview(part).nbytes
+        return size
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_buffer(cls, buffer) -> 'AddressBatch':
+        """Batch backed by a buffer produced by write / to_bytes (e.g. an mmap), nothing is copied"""
+        view = memoryview(buffer).cast('B')
+        magic, version, *lengths = struct.unpack_from('<4sBBBB', view)
+        assert magic == MAGIC, 'Not an address batch'
+        assert version == VERSION, f'Unsupported version {version}'
+        offset = 8
+        strings = []
+        for length in lengths:
+            strings.append(bytes(view[offset:offset + length]).decode())
+            offset += length
+        address_type, network, path = strings
+        offset += -offset % 4
+        count, = struct.unpack_from('<I', view, offset)
+        offset += 4
+
+        indexes = view[offset:offset + 4 * count]
+        if sys.byteorder == 'little':
+            indexes = indexes.cast('I')
+        else:
+            indexes = array('I', bytes(indexes))
+            indexes.byteswap()
+        offset += 4 * count
+        public_keys = view[offset:offset + KEY_SIZE * count]
+        offset += KEY_SIZE * count
+        hashes = view[offset:offset + HASH_SIZE * count]
+        assert len(hashes) == HASH_SIZE * count, 'Truncated address batch'
+        return cls(indexes, public_keys, hashes, address_type, network, path or None)
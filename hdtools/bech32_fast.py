@@ -0,0 +1,142 @@
+"""
+Table-driven Bech32 / segwit address codec working on bytes
+Behaves like the reference implementation in hdtools.bech32 (same results, same errors) but:
+    * the checksum consumes two symbols per step through a 1024-entry table
+    * the checksum state after the HRP is cached per HRP
+    * 8 <-> 5 bit conversion goes through a single int instead of a per-bit loop
+    * witness programs are bytes and encode_many / decode_many handle lists
+"""
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+from hdtools.bech32 import CHARSET, Bech32DecodeError
+
+GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+
+
+def _step(chk: int, value: int) -> int:
+    top = chk >> 25
+    chk = (chk & 0x1ffffff) << 5 ^ value
+    for i in range(5):
+        chk ^= GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+TABLE_5 = [_step(top << 25, 0) for top in range(32)]
+TABLE_10 = [_step(_step(top << 20, 0), 0) for top in range(1024)]
+
+ENCODE_TABLE = bytes.maketrans(bytes(range(32)), CHARSET.encode())
+DECODE_TABLE = bytes.maketrans(CHARSET.encode(), bytes(range(32)))
+INVALID = bytes(set(range(256)) - set(CHARSET.encode()))
+
+
+def polymod(values: bytes, chk=1) -> int:
+    """Same as bech32_polymod, continuing from chk"""
+    table = TABLE_10
+    end = len(values) & ~1
+    for i in range(0, end, 2):
+        chk = ((chk & 0xfffff) << 10) ^ (values[i] << 5 | values[i + 1]) ^ table[chk >> 20]
+    if end != len(values):
+        chk = ((chk & 0x1ffffff) << 5) ^ values[-1] ^ TABLE_5[chk >> 25]
+    return chk
+
+
+@lru_cache(maxsize=32)
+def hrp_state(hrp: str) -> int:
+    """Checksum state after the expanded HRP"""
+    return polymod(bytes([ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]))
+
+
+def to_5bit(data: bytes) -> bytes:
+    """convertbits(data, 8, 5, pad=True)"""
+    bits = len(data) * 8
+    groups = (bits + 4) // 5
+    value = int.from_bytes(data, 'big') << (groups * 5 - bits)
+    return bytes((value >> shift) & 31 for shift in range(5 * (groups - 1), -1, -5))
+
+
+def from_5bit(data: bytes) -> bytes:
+    """convertbits(data, 5, 8, pad=False)"""
+    value = 0
+    for digit in data:
+        value = value << 5 | digit
+    length, padding = divmod(len(data) * 5, 8)
+    if padding >= 5 or value & ((1 << padding) - 1):
+        raise Bech32DecodeError
+    return (value >> padding).to_bytes(length, 'big')
+
+
+def bech32_encode(hrp: str, data: bytes) -> str:
+    """Compute a Bech32 string given HRP and 5-bit data values"""
+    checksum = polymod(bytes(6), polymod(data, hrp_state(hrp))) ^ 1
+    combined = data + bytes((checksum >> shift) & 31 for shift in (25, 20, 15, 10, 5, 0))
+    return hrp + '1' + combined.translate(ENCODE_TABLE).decode()
+
+
+def bech32_decode(bech: str) -> Tuple[str, bytes]:
+    """Validate a Bech32 string, and determine HRP and 5-bit data values"""
+    if any(ord(x) < 33 or ord(x) > 126 for x in bech):
+        raise Bech32DecodeError('Character outside the US-ASCII [33-126] range')
+
+    lower = bech.lower()
+    if lower != bech and bech.upper() != bech:
+        raise Bech32DecodeError('Mixed upper and lower case')
+
+    bech = lower
+    pos = bech.rfind('1')
+
+    if pos == 0:
+        raise Bech32DecodeError('Empty human readable part')
+    elif pos == -1:
+        raise Bech32DecodeError('No seperator character')
+    elif pos + 7 > len(bech):
+        raise Bech32DecodeError('Checksum too short')
+
+    if len(bech) > 90:
+        raise Bech32DecodeError('Max string length exceeded')
+
+    encoded = bech[pos + 1:].encode()
+    data = encoded.translate(DECODE_TABLE, INVALID)
+    if len(data) != len(encoded):
+        raise Bech32DecodeError('Character not in charset')
+
+    hrp = bech[:pos]
+    if polymod(data, hrp_state(hrp)) != 1:
+        raise Bech32DecodeError('Invalid checksum')
+
+    return hrp, data[:-6]
+
+
+def decode(hrp: str, addr: str) -> Tuple[int, bytes]:
+    """Decode a segwit address"""
+    hrpgot, data = bech32_decode(addr)
+    if hrpgot != hrp:
+        raise Bech32DecodeError('Human readable part mismatch')
+
+    decoded = from_5bit(data[1:])
+    if len(decoded) < 2:
+        raise Bech32DecodeError('Witness programm too short')
+    elif len(decoded) > 40:
+        raise Bech32DecodeError('Witness programm too long')
+
+    if data[0] > 16:
+        raise Bech32DecodeError('Invalid witness version')
+
+    if data[0] == 0 and (len(decoded) not in (20, 32)):
+        raise Bech32DecodeError('Could not interpret witness programm')
+
+    return data[0], decoded
+
+
+def encode(hrp: str, witver: int, witprog: bytes) -> str:
+    """Encode a segwit address"""
+    return bech32_encode(hrp, bytes([witver]) + to_5bit(bytes(witprog)))
+
+
+def encode_many(hrp: str, programs: Iterable[Tuple[int, bytes]]) -> List[str]:
+    """Encode (witver, witprog) pairs"""
+    return [encode(hrp, witver, witprog) for witver, witprog in programs]
+
+
+def decode_many(hrp: str, addresses: Iterable[str]) -> List[Tuple[int, bytes]]:
+    return [decode(hrp, address) for address in addresses]
@@ -0,0 +1,357 @@
+"""
+Benchmark suite for the derivation, encoding and decoding hot paths
+Run with: python -m hdtools.bench [NAME ...] [--sizes 1,1000,100000] [-o baseline.json] [--compare baseline.json]
+
+Every benchmark runs one operation per item over 1-, 1k- and 100k-item workloads (some are capped, see
+Benchmark.limit) and reports ops/sec, per-operation latency percentiles and the tracemalloc peak of a
+second, separate pass. Inputs are built before timing and each item is used once, so per-object caches
+(encodings, public keys) are cold. Results can be written to a JSON baseline and compared against it.
+
+--verify compares ECDSA verification through the ecdsa package with PublicKey.verify on every
+available backend and with verify_many across worker processes.
+
+--import-time measures `import hdtools.extended_keys` in fresh interpreters with python -X importtime
+and fails (exit status 1) above IMPORT_BUDGET_MS or if an optional dependency is imported eagerly.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from hdtools import backends
+from hdtools.keys import PrivateKey, PublicKey
+from hdtools.parallel import verify_many
+
+DEFAULT_SIZES = (1, 1000, 100000)
+BASELINE_VERSION = 1
+
+IMPORT_MODULE = 'hdtools.extended_keys'
+IMPORT_BUDGET_MS = 60  # best of IMPORT_RUNS cold imports, about 35 ms on a current x86-64 machine
+IMPORT_RUNS = 5
+LAZY_DEPENDENCIES = ('ecdsa', 'mnemonic', 'base58', 'coincurve')  # must only be imported on first use
+
+SEED = '000102030405060708090a0b0c0d0e0f'
+MNEMONIC = 'lemon child success once board usual cigar buffalo video cheese kitten onion build axis dose'
+
+
+class Benchmark(NamedTuple):
+    name: str
+    setup: Callable[[int], Tuple[Callable, Sequence]]  # size -> (operation, items), not timed
+    limit: Optional[int] = None  # largest workload worth running
+
+
+def _master(address_type='P2PKH'):
+    from hdtools.extended_keys import XPrv
+    return XPrv.from_seed(SEED, address_type=address_type)
+
+
+def _xpubs(n: int) -> list:
+    return (_master() / 0).to_xpub().derive_range(0, n)
+
+
+def _programs(n: int) -> List[bytes]:
+    return [hashlib.new('ripemd160', i.to_bytes(4, 'big')).digest() for i in range(n)]
+
+
+def _signatures(n: int) -> List[Tuple[PrivateKey, bytes, bytes]]:
+    items = []
+    for i in range(n):
+        key = PrivateKey(hashlib.sha256(b'key' + i.to_bytes(4, 'big')).digest())
+        digest = hashlib.sha256(b'message' + i.to_bytes(4, 'big')).digest()
+        items.append((key, digest, key.sign(digest)))
+    return items
+
+
+def setup_from_mnemonic(n):
+    from hdtools.extended_keys import XPrv
+    return lambda passphrase: XPrv.from_mnemonic(MNEMONIC, passphrase), [str(i) for i in range(n)]
+
+
+def setup_xprv_child(hardened: bool):
+    def setup(n):
+        master = _master()
+        master.public_key()
+        offset = 1 << 31 if hardened else 0
+        return master.child, range(offset, offset + n)
+    return setup
+
+
+def setup_xpub_child(n):
+    return _master().to_xpub().child, range(n)
+
+
+def setup_address(address_type: str):
+    def setup(n):
+        return lambda xpub: xpub.address(address_type), _xpubs(n)
+    return setup
+
+
+def setup_xkey_encode(n):
+    return lambda xpub: xpub.encode(), _xpubs(n)
+
+
+def setup_xkey_decode(n):
+    from hdtools.extended_keys import ExtendedKey
+    return ExtendedKey.decode, [xpub.encode() for xpub in _xpubs(n)]
+
+
+def setup_public_key_decode(n):
+    return PublicKey.decode, [xpub.key.encode(compressed=True) for xpub in _xpubs(n)]
+
+
+def setup_bech32_encode(n):
+    from hdtools import bech32_fast
+    return lambda program: bech32_fast.encode('bc', 0, program), _programs(n)
+
+
+def setup_bech32_decode(n):
+    from hdtools import bech32_fast
+    addresses = [bech32_fast.encode('bc', 0, program) for program in _programs(n)]
+    return lambda address: bech32_fast.decode('bc', address), addresses
+
+
+def setup_base58_encode(n):
+    from hdtools.base58check import encode_check
+    return encode_check, [b'\x00' + program for program in _programs(n)]
+
+
+def setup_base58_decode(n):
+    from hdtools.base58check import ADDRESS_LENGTH, decode_check, encode_check
+    addresses = [encode_check(b'\x00' + program) for program in _programs(n)]
+    return lambda address: decode_check(address, ADDRESS_LENGTH), addresses
+
+
+def setup_verify(n):
+    items = [(key.to_public(), digest, sig) for key, digest, sig in _signatures(n)]
+    return lambda item: item[0].verify(item[1], item[2]), items
+
+
+def setup_ecdsa_verify(n):
+    from ecdsa import SECP256k1, VerifyingKey
+    from ecdsa.util import sigdecode_der
+    items = [(VerifyingKey.from_string(key.to_public().encode(compressed=True), curve=SECP256k1), digest, sig)
+             for key, digest, sig in _signatures(n)]
+    return lambda item: item[0].verify_digest(item[2], item[1], sigdecode=sigdecode_der), items
+
+
+BENCHMARKS = [
+    Benchmark('XPrv.from_mnemonic', setup_from_mnemonic, limit=1000),
+    Benchmark('XPrv.child', setup_xprv_child(hardened=False)),
+    Benchmark('XPrv.child hardened', setup_xprv_child(hardened=True)),
+    Benchmark('XPub.child', setup_xpub_child),
+    Benchmark('XPub.address P2PKH', setup_address('P2PKH')),
+    Benchmark('XPub.address P2WPKH-P2SH', setup_address('P2WPKH-P2SH')),
+    Benchmark('XPub.address P2WPKH', setup_address('P2WPKH')),
+    Benchmark('ExtendedKey.encode', setup_xkey_encode),
+    Benchmark('ExtendedKey.decode', setup_xkey_decode),
+    Benchmark('PublicKey.decode', setup_public_key_decode),
+    Benchmark('bech32 encode', setup_bech32_encode),
+    Benchmark('bech32 decode', setup_bech32_decode),
+    Benchmark('base58check encode', setup_base58_encode),
+    Benchmark('base58check decode', setup_base58_decode),
+    Benchmark('PublicKey.verify', setup_verify, limit=1000),
+    Benchmark('ecdsa VerifyingKey.verify_digest', setup_ecdsa_verify, limit=1000),
+]
+
+
+def percentile(ordered: List[int], q: float) -> int:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(benchmark: Benchmark, size: int, memory=True) -> dict:
+    """Time one operation per item, then measure the tracemalloc peak of a second run on fresh inputs"""
+    operation, items = benchmark.setup(size)
+    clock = time.perf_counter_ns
+    latencies = []
+    gc.disable()
+    try:
+        for item in items:
+            start = clock()
+            operation(item)
+            latencies.append(clock() - start)
+    finally:
+        gc.enable()
+    latencies.sort()
+
+    result = {
+        'name': benchmark.name,
+        'size': size,
+        'ops_per_sec': size * 1e9 / (sum(latencies) or 1),
+        'p50_us': percentile(latencies, 0.50) / 1e3,
+        'p90_us': percentile(latencies, 0.90) / 1e3,
+        'p99_us': percentile(latencies, 0.99) / 1e3,
+        'max_us': latencies[-1] / 1e3,
+        'peak_kib': None,
+    }
+    if memory:
+        operation, items = benchmark.setup(size)
+        tracemalloc.start()
+        try:
+            for item in items:
+                operation(item)
+            result['peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_all(names=None, sizes=DEFAULT_SIZES, memory=True, report: Callable[[dict], None] = None) -> List[dict]:
+    """Run the benchmarks whose name contains one of names (all by default), report is called per result"""
+    results = []
+    for benchmark in BENCHMARKS:
+        if names and not any(name.lower() in benchmark.name.lower() for name in names):
+            continue
+        for size in sizes:
+            if benchmark.limit is not None and size > benchmark.limit:
+                continue
+            result = run(benchmark, size, memory)
+            results.append(result)
+            if report:
+                report(result)
+    return results
+
+
+def baseline(results: List[dict], label=None) -> dict:
+    return {
+        'version': BASELINE_VERSION,
+        'label': label,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': backends.current().name,
+        'results': results,
+    }
+
+
+def compare(results: List[dict], reference: dict) -> Dict[Tuple[str, int], float]:
+    """(name, size) -> ops/sec ratio against a baseline, > 1 is faster"""
+    assert reference.get('version') == BASELINE_VERSION, 'Unsupported baseline version'
+    previous = {(result['name'], result['size']): result['ops_per_sec'] for result in reference['results']}
+    return {
+        (result['name'], result['size']): result['ops_per_sec'] / previous[result['name'], result['size']]
+        for result in results if (result['name'], result['size']) in previous
+    }
+
+
+def bench_verify(count: int) -> List[Tuple[str, float]]:
+    """(name, signatures per second) of every verification path"""
+    def timed(func: Callable) -> float:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    verify_ecdsa, ecdsa_items = setup_ecdsa_verify(count)
+    results = [('ecdsa VerifyingKey.verify_digest', count / timed(lambda: [verify_ecdsa(i) for i in ecdsa_items]))]
+
+    items = [(key.to_public(), digest, sig) for key, digest, sig in _signatures(count)]
+
+    def run_verify():
+        for public, digest, sig in items:
+            assert public.verify(digest, sig)
+    for name in backends.available_backends():
+        with backends.using(name):
+            public, digest, sig = items[0]
+            public.verify(digest, sig)  # warm-up, builds the lookup tables
+            results.append((f'PublicKey.verify [{name}]', count / timed(run_verify)))
+
+    def run_verify_many():
+        assert all(verify_many(items, chunk_size=max(1, count // 8)))
+    results.append(('verify_many [processes]', count / timed(run_verify_many)))
+    return results
+
+
+def import_time(module=IMPORT_MODULE, runs=IMPORT_RUNS) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Best cumulative import time of module over runs fresh interpreters in ms, with the imports of that
+    best run sorted by self time
+    """
+    best = None
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                 stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        imports = []
+        total = None
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((name.strip(), int(own) / 1e3))
+            if name.strip() == module:
+                total = int(cumulative) / 1e3
+        if best is None or total < best[0]:
+            best = (total, sorted(imports, key=lambda item: -item[1]))
+    return best
+
+
+def eager_dependencies(module=IMPORT_MODULE) -> List[str]:
+    """LAZY_DEPENDENCIES loaded by importing module"""
+    code = f'import sys, {module}; print(" ".join(sys.modules))'
+    loaded = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout.split()
+    return sorted({name.split('.')[0] for name in loaded} & set(LAZY_DEPENDENCIES))
+
+
+def _format(result: dict, ratio: Optional[float] = None) -> str:
+    peak = '-' if result['peak_kib'] is None else f"{result['peak_kib']:,.0f}"
+    line = (f"{result['name']:<34} {result['size']:>7} {result['ops_per_sec']:>12,.0f} "
+            f"{result['p50_us']:>9.1f} {result['p90_us']:>9.1f} {result['p99_us']:>9.1f} {peak:>10}")
+    return line if ratio is None else line + f' {ratio:>7.2f}x'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma separated workloads')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('-o', '--output', help='write the results to this JSON baseline')
+    parser.add_argument('--label', help='label stored in the baseline, e.g. a commit hash')
+    parser.add_argument('--compare', help='JSON baseline to compare ops/sec against')
+    parser.add_argument('--backend', help='crypto backend to use')
+    parser.add_argument('--verify', type=int, metavar='COUNT', help='only compare the verification paths')
+    parser.add_argument('--import-time', action='store_true', help=f'only check the import time of {IMPORT_MODULE}')
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        total, imports = import_time()
+        eager = eager_dependencies()
+        print(f'import {IMPORT_MODULE}: {total:.1f} ms (budget {IMPORT_BUDGET_MS} ms, best of {IMPORT_RUNS})')
+        for name, own in imports[:10]:
+            print(f'    {name:<40} {own:>8.2f} ms')
+        if eager:
+            print(f'imported eagerly: {", ".join(eager)}')
+        sys.exit(0 if total <= IMPORT_BUDGET_MS and not eager else 1)
+    if args.backend:
+        backends.set_backend(args.backend)
+    if args.verify:
+        for name, rate in bench_verify(args.verify):
+            print(f'{name:<40} {rate:>12,.0f} / s')
+        return
+
+    reference = None
+    if args.compare:
+        with open(args.compare) as fp:
+            reference = json.load(fp)
+
+    def report(result):
+        ratio = compare([result], reference).get((result['name'], result['size'])) if reference else None
+        print(_format(result, ratio), flush=True)
+
+    print(f'backend: {backends.current().name}, python {platform.python_version()}', file=sys.stderr)
+    print(f"{'benchmark':<34} {'size':>7} {'ops/s':>12} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'peak KiB':>10}"
+          + (' vs base' if reference else ''))
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_all(args.names, sizes, memory=not args.no_memory, report=report)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(baseline(results, args.label), fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
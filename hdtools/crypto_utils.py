@@ -1,4 +1,7 @@
 import hashlib
+import hmac
+
+from hdtools import backends
 
 
 def sha256(x):
@@ -9,5 +12,9 @@ def sha512(x):
     return hashlib.sha512(x).digest()
 
 
+def hmac_sha512(key, msg):
+    return hmac.digest(key, msg, 'sha512')
+
+
 def hash160(x):
-    return hashlib.new('ripemd160', sha256(x)).digest()
+    return backends.current().hash160(x)
@@ -0,0 +1,105 @@
+"""
+BIP32 path parsing and a shared cache of intermediate derivation nodes
+References:
+    https://github.com/bitcoin/bips/blob/master/bip-0032.mediawiki#the-key-tree
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+HARDENED = 1 << 31
+HARDENED_MARKERS = ("'", 'h', 'H')
+
+Path = Tuple[int, ...]
+
+
+def parse_path(path: str) -> Path:
+    """
+    Parse "m/84'/0'/0'/0/15" (or 84h/0h/0h/0/15) into child indexes, hardened ones offset by 2^31
+    The leading m/M is optional, indexes are always relative to the key they are applied to
+    """
+    parts = path.strip().split('/')
+    if parts[0] in ('m', 'M'):
+        parts = parts[1:]
+
+    indexes = []
+    for part in parts:
+        hardened = part[-1:] in HARDENED_MARKERS
+        index = part[:-1] if hardened else part
+        assert re.fullmatch(r'[0-9]+', index), f'Invalid path component: {part!r}'
+        i = int(index)
+        assert i < HARDENED, f'Path index out of range: {part!r}'
+        indexes.append(i + HARDENED if hardened else i)
+    return tuple(indexes)
+
+
+class NodeCache:
+    """
+    Bounded LRU cache of intermediate extended keys, keyed by (root, path prefix)
+    Sibling paths share their parents, so "m/84'/0'/0'/0/1" and "m/84'/0'/0'/0/2" derive
+    only their last level once "m/84'/0'/0'/0" is cached.
+    Statistics are counted per node: hits are nodes reused from the cache, misses are
+    intermediate nodes that had to be derived.
+    """
+
+    def __init__(self, max_size=1024):
+        assert max_size >= 0, 'max_size must be non-negative'
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nodes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def lookup(self, root: bytes, indexes: Path):
+        """Return (depth, node) for the longest cached prefix of indexes, (0, None) if none is cached"""
+        with self._lock:
+            for depth in range(len(indexes), 0, -1):
+                key = (root, indexes[:depth])
+                node = self._nodes.get(key)
+                if node is not None:
+                    self._nodes.move_to_end(key)
+                    self.hits += depth
+                    return depth, node
+        return 0, None
+
+    def put(self, root: bytes, indexes: Path, node):
+        with self._lock:
+            self.misses += 1
+            if not self.max_size:
+                return
+            self._nodes[(root, indexes)] = node
+            self._nodes.move_to_end((root, indexes))
+            self._evict()
+
+    def resize(self, max_size: int):
+        assert max_size >= 0, 'max_size must be non-negative'
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._nodes),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while len(self._nodes) > self.max_size:
+            self._nodes.popitem(last=False)
+            self.evictions += 1
+
+
+node_cache = NodeCache()
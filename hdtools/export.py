@@ -0,0 +1,129 @@
+"""
+Streaming address export: CSV, NDJSON and a fixed-width binary format
+
+Rows are generated lazily in chunks and written in large buffered blocks, so memory use does not
+depend on the size of the range. Addresses are rendered with XPub.address, so they are identical
+to the ones returned by the key objects.
+
+Binary layout:
+    header: b'HDAX', version (u8), type count (u8), then per type: width (u8), name length (u8), name
+    record: index (u32, big endian), then every address left-justified and NUL padded to its width
+"""
+import json
+import struct
+from typing import BinaryIO, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from hdtools.extended_keys import ExtendedKey
+from hdtools.opcodes import AddressType
+from hdtools.parallel import chain_xpub
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+DEFAULT_CHUNK_SIZE = 1000
+
+BINARY_MAGIC = b'HDAX'
+BINARY_VERSION = 1
+BINARY_WIDTHS = {
+    AddressType.P2PKH.value: 35,
+    AddressType.P2SH.value: 35,
+    AddressType.P2WPKH_P2SH.value: 35,
+    AddressType.P2WSH_P2SH.value: 35,
+    AddressType.P2WPKH.value: 62,
+    AddressType.P2WSH.value: 62,
+}
+
+Row = Tuple  # (index, address, ...)
+
+
+def iter_addresses(xkey: ExtendedKey, chain: Optional[int], start: int, stop: int, types=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE) -> Iterator[Row]:
+    """Lazily yield (i, address, ...) of xkey/chain/i for i in [start, stop), one address per type"""
+    node = chain_xpub(xkey, chain)
+    types = normalize_types(types, node)
+    for chunk in range(start, stop, chunk_size):
+        for child in node.derive_range(chunk, min(chunk_size, stop - chunk)):
+            yield (child.i,) + tuple(child.address(address_type) for address_type in types)
+
+
+def normalize_types(types, node=None) -> List[str]:
+    if not types:
+        return [node.type.value]
+    return [AddressType(address_type).value for address_type in types]
+
+
+def _write_buffered(pieces: Iterable, fp, buffer_size: int, empty) -> int:
+    """Write pieces (str or bytes) in blocks of at least buffer_size, returns the number of pieces"""
+    written, size, buffer = 0, 0, []
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        written += 1
+        if size >= buffer_size:
+            fp.write(empty.join(buffer))
+            size, buffer = 0, []
+    if buffer:
+        fp.write(empty.join(buffer))
+    return written
+
+
+def write_csv(rows: Iterable[Row], fp: TextIO, types, header=True, buffer_size=DEFAULT_BUFFER_SIZE) -> int:
+    if header:
+        fp.write(','.join(['index'] + normalize_types(types)) + '\n')
+    lines = (','.join(map(str, row)) + '\n' for row in rows)
+    return _write_buffered(lines, fp, buffer_size, '')
+
+
+def write_ndjson(rows: Iterable[Row], fp: TextIO, types, buffer_size=DEFAULT_BUFFER_SIZE) -> int:
+    keys = ['index'] + normalize_types(types)
+    lines = (json.dumps(dict(zip(keys, row))) + '\n' for row in rows)
+    return _write_buffered(lines, fp, buffer_size, '')
+
+
+def write_binary(rows: Iterable[Row], fp: BinaryIO, types, buffer_size=DEFAULT_BUFFER_SIZE) -> int:
+    types = normalize_types(types)
+    widths = [BINARY_WIDTHS[address_type] for address_type in types]
+    header = BINARY_MAGIC + struct.pack('>BB', BINARY_VERSION, len(types))
+    for address_type, width in zip(types, widths):
+        header += struct.pack('>BB', width, len(address_type)) + address_type.encode()
+    fp.write(header)
+
+    record = struct.Struct('>I' + ''.join(f'{width}s' for width in widths))
+    records = (record.pack(row[0], *(address.encode() for address in row[1:])) for row in rows)
+    return _write_buffered(records, fp, buffer_size, b'')
+
+
+def read_binary(fp: BinaryIO, buffer_size=DEFAULT_BUFFER_SIZE) -> Iterator[Row]:
+    """Read back a file produced by write_binary"""
+    magic, version, count = struct.unpack('>4sBB', fp.read(6))
+    assert magic == BINARY_MAGIC, 'Not an address export file'
+    assert version == BINARY_VERSION, f'Unsupported version {version}'
+    widths = []
+    for _ in range(count):
+        width, length = struct.unpack('>BB', fp.read(2))
+        fp.read(length)
+        widths.append(width)
+
+    record = struct.Struct('>I' + ''.join(f'{width}s' for width in widths))
+    per_block = max(1, buffer_size // record.size)
+    while True:
+        block = fp.read(record.size * per_block)
+        assert len(block) % record.size == 0, 'Truncated record'
+        if not block:
+            return
+        for index, *addresses in record.iter_unpack(block):
+            yield (index,) + tuple(address.rstrip(b'\x00').decode() for address in addresses)
+
+
+WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'binary': write_binary,
+}
+
+
+def export_addresses(xkey: ExtendedKey, chain: Optional[int], start: int, stop: int, fp, fmt='csv', types=None,
+                     **kwargs) -> int:
+    """Stream the addresses of xkey/chain/i for i in [start, stop) to fp, returns the number of rows"""
+    assert fmt in WRITERS, f'Unknown format {fmt}, expected one of {sorted(WRITERS)}'
+    node = chain_xpub(xkey, chain)
+    types = normalize_types(types, node)
+    return WRITERS[fmt](iter_addresses(node, None, start, stop, types), fp, types, **kwargs)
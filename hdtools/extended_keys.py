@@ -4,24 +4,33 @@ References:
     https://github.com/bitcoin/bips/blob/master/bip-0032.mediawiki#child-key-derivation-functions
     https://iancoleman.io/bip39/
 """
-import hashlib
-from typing import Union
-
-from base58 import b58encode, b58decode
-import hmac
-
-from mnemonic import Mnemonic
+import struct
+from array import array
+from typing import TYPE_CHECKING, Iterable, List, Union
 
 from hdtools.conversions import bytes_to_int, int_to_bytes, bytes_to_hex, hex_to_bytes
-from hdtools.network import get_network_attr
+from hdtools.network import extended_versions, get_network_attr
 from hdtools.opcodes import AddressType
-from hdtools.keys import PrivateKey, PublicKey, DefaultCurve
-from hdtools.crypto_utils import hash160, sha256, sha512
+from hdtools.keys import PrivateKey, PublicKey
+from hdtools.crypto_utils import hash160, hmac_sha512
+from hdtools.base58check import Base58DecodeError, b58decode, encode_check, checksum as base58_checksum
+from hdtools import backends
+from hdtools.secp256k1 import N
+from hdtools.derivation import NodeCache, node_cache, parse_path
+from hdtools.seed import SeedCache, mnemonic_to_seed
+
+if TYPE_CHECKING:
+    from hdtools.batch import AddressBatch
 
 Key = Union[PrivateKey, PublicKey]
 
+# version, depth, parent fingerprint, child number, chain code, key data
+SERIALIZED = struct.Struct('>4sB4sI32s33s')
+SHARED_CACHE = object()  # derive(): node_cache for extended public keys, no cache for private ones
+
 
 class ExtendedKey:
+    __slots__ = ('key', 'code', 'depth', 'i', 'parent', 'path', 'type', '_id')
     root_path = NotImplemented
 
     def __init__(self, key: Key, code: bytes, depth=0, i=None, parent=b'\x00\x00\x00\x00', path=None,
@@ -53,10 +62,47 @@ class ExtendedKey:
             f"parent={bytes_to_hex(self.parent)})"
 
         self.type = AddressType(address_type)
+        self._id = None
 
     def child(self, i):
         raise NotImplementedError
 
+    def derive(self, path: str, cache: NodeCache = SHARED_CACHE) -> 'ExtendedKey':
+        """
+        Derive a BIP32 path, e.g. M.derive("m/84'/0'/0'/0/15") or xpub.derive("0/15")
+        Absolute paths (m/... or M/...) are only accepted on master keys, other paths are relative to this key.
+        Intermediate nodes of extended public keys are shared through node_cache by default, private nodes are
+        only kept in a cache passed explicitly (None disables caching)
+        """
+        assert path.strip()[:1] not in ('m', 'M') or self.is_master(), \
+            f'Absolute path {path!r} on a key at depth {self.depth}, use a path relative to {self.path}'
+        if cache is SHARED_CACHE:
+            cache = node_cache if isinstance(self.key, PublicKey) else None
+        indexes = parse_path(path)
+        node, depth = self, 0
+        if cache is not None and len(indexes) > 1:
+            root = self.serialize()
+            depth, cached = cache.lookup(root, indexes[:-1])
+            node = cached or self
+        for depth in range(depth, len(indexes)):
+            node = node.child(indexes[depth])
+            if cache is not None and depth < len(indexes) - 1:
+                cache.put(root, indexes[:depth + 1], node)
+        return node
+
+    def derive_range(self, start: int, count: int) -> list:
+        raise NotImplementedError
+
+    def derive_many(self, indexes: Iterable[int]) -> list:
+        """Same as [self.child(i) for i in indexes]"""
+        return [self.child(i) for i in indexes]
+
+    def address_range(self, start: int, count: int, address_type=None) -> list:
+        return [child.address(address_type) for child in self.derive_range(start, count)]
+
+    def _check_range(self, start: int, count: int, end=1 << 32):
+        assert 0 <= start and 0 <= count and start + count <= end, f'Invalid range: start={start}, count={count}'
+
     def is_master(self):
         return self.depth == 0 and \
                self.i is None and \
@@ -80,6 +126,12 @@ class ExtendedKey:
         return self.child(other + 2 ** 31)
 
     def id(self):
+        """hash160 of the compressed public key, computed once"""
+        if self._id is None:
+            self._id = hash160(self.public_key().encode(compressed=True))
+        return self._id
+
+    def public_key(self) -> PublicKey:
         raise NotImplementedError
 
     def fingerprint(self):
@@ -91,48 +143,61 @@ class ExtendedKey:
     def encode(self):
         data = self.serialize()
         assert len(data) == 78
-        checksum = sha256(sha256(data))[:4]
-        return b58encode(data + checksum)
+        return encode_check(data).encode()
 
     @classmethod
-    def deserialize(cls, bts: bytes, network='btc'):
-        def read(n):
-            nonlocal bts
-            data, bts = bts[:n], bts[n:]
-            return data
-
-        net = read(4)
-        is_private = net in get_network_attr('extended_prv', network).values()
-        is_public = net in get_network_attr('extended_pub', network).values()
-        assert is_public ^ is_private, f'Invalid network bytes : {bytes_to_hex(net)}'
-        address_lookup = {val: key for key, val in (
-            get_network_attr('extended_prv', network) if is_private else get_network_attr('extended_pub',
-                                                                                          network)).items()}
+    def deserialize(cls, bts: bytes, network='btc', lazy=False):
+        """
+        Parse the 78-byte serialization (bytes or memoryview) in a single struct unpack
+        network=None accepts any known network, lazy defers public key decompression to first use
+        """
+        assert len(bts) == SERIALIZED.size, f'Invalid length {len(bts)}'
+        net, depth, fingerprint, i, code, key = SERIALIZED.unpack_from(bts)
+        assert net in extended_versions, f'Invalid network bytes : {bytes_to_hex(net)}'
+        key_network, address_type, is_private = extended_versions[net]
+        network = network or key_network
+        assert key_network == network, f'Invalid network bytes : {bytes_to_hex(net)}'
+
         constructor = XPrv if is_private else XPub
-        depth = bytes_to_int(read(1))
-        assert depth in range(256), f'Invalid depth : {depth}'
-        fingerprint = read(4)
-        i = bytes_to_int(read(4))
         if depth == 0:
             i = None
             path = None
         else:
             ih = f'{i}' if i < 2 ** 31 else f"{i - 2 ** 31}h"
-            path = '/'.join([constructor.root_path] + ['x' for _ in range(depth - 1)] + [ih])
+            path = constructor.root_path + '/x' * (depth - 1) + '/' + ih
 
-        code = read(32)
-        key = read(33)
-        key = PrivateKey(key, network=network) if is_private else PublicKey.decode(key, network=network)
-        assert not bts, 'Leftover bytes'
-        return constructor(key, code, depth=depth, i=i, parent=fingerprint, path=path, address_type=address_lookup[net])
+        if is_private:
+            assert key[0] == 0, 'Invalid private key data'
+            key = PrivateKey(key[1:], network=network)
+        else:
+            key = PublicKey.decode(key, network=network, lazy=lazy)
+        return constructor(key, code, depth=depth, i=i, parent=fingerprint, path=path,
+                           address_type=address_type.value)
 
     @classmethod
-    def decode(cls, string: str, network='btc'):
+    def decode(cls, string: str, network='btc', lazy=False):
         bts = b58decode(string)
         assert len(bts) == 82, f'Invalid length {len(bts)}'
-        data, checksum = bts[:78], bts[78:]
-        assert sha256(sha256(data)).startswith(checksum), 'Invalid checksum'
-        return cls.deserialize(data, network)
+        view = memoryview(bts)
+        assert base58_checksum(view[:78]) == bts[78:], 'Invalid checksum'
+        return cls.deserialize(view[:78], network, lazy)
+
+    @classmethod
+    def decode_many(cls, strings, network=None, lazy=False, strict=True) -> list:
+        """
+        Decode many encoded extended keys, of any known network unless network is given
+        With strict=False invalid keys are returned as None instead of raising
+        """
+        decode = cls.decode
+        if strict:
+            return [decode(string, network, lazy) for string in strings]
+        keys = []
+        for string in strings:
+            try:
+                keys.append(decode(string, network, lazy))
+            except (AssertionError, Base58DecodeError):
+                keys.append(None)
+        return keys
 
     def __eq__(self, other):
         return self.encode() == other.encode
@@ -143,28 +208,19 @@ class KeyDerivationError(Exception):  # TODO
 
 
 class XPrv(ExtendedKey):
+    __slots__ = ()
     root_path = 'm'
 
     def child(self, i) -> 'XPrv':
         hardened = i >= 1 << 31
 
-        if hardened:
-            I = hmac.new(
-                key=self.code,
-                msg=self.key_data() + int_to_bytes(i).rjust(4, b'\x00'),
-                digestmod=hashlib.sha512
-            ).digest()
-        else:
-            I = hmac.new(
-                key=self.code,
-                msg=self.key.to_public().encode(compressed=True) + int_to_bytes(i).rjust(4, b'\x00'),
-                digestmod=hashlib.sha512
-            ).digest()
+        data = self.key_data() if hardened else self.public_key().encode(compressed=True)
+        I = hmac_sha512(self.code, data + int_to_bytes(i).rjust(4, b'\x00'))
 
         I_L, I_R = bytes_to_int(I[:32]), I[32:]
-        key = (I_L + self.key.int()) % DefaultCurve.order
+        key = (I_L + self.key.int()) % N
 
-        if I_L >= DefaultCurve.order or key == 0:
+        if I_L >= N or key == 0:
             return self.child(i + 1)
 
         ret_code = I_R
@@ -185,9 +241,44 @@ class XPrv(ExtendedKey):
             address_type=self.type.value
         )
 
+    def derive_range(self, start: int, count: int) -> List['XPrv']:
+        """Same as [self.child(i) for i in range(start, start + count)], parent data is computed once"""
+        self._check_range(start, count)
+        parent = self.fingerprint()
+        network = self.key.network
+        address_type = self.type.value
+        parent_key = self.key.int()
+        private_data = self.key_data()
+        public_data = self.public_key().encode(compressed=True) if start < 1 << 31 else None
+
+        children = []
+        for i in range(start, start + count):
+            hardened = i >= 1 << 31
+            data = private_data if hardened else public_data
+            I = hmac_sha512(self.code, data + int_to_bytes(i).rjust(4, b'\x00'))
+
+            I_L, I_R = bytes_to_int(I[:32]), I[32:]
+            key = (I_L + parent_key) % N
+            if I_L >= N or key == 0:
+                children.append(self.child(i))
+                continue
+
+            private = PrivateKey.from_int(key)
+            private.network = network
+            children.append(XPrv(
+                key=private,
+                code=I_R,
+                depth=self.depth + 1,
+                i=i,
+                parent=parent,
+                path=self.path + (f'/{i - 2 ** 31}h' if hardened else f'/{i}'),
+                address_type=address_type
+            ))
+        return children
+
     def to_xpub(self) -> 'XPub':
         return XPub(
-            self.key.to_public(),
+            self.public_key(),
             self.code,
             depth=self.depth,
             i=self.i,
@@ -200,8 +291,8 @@ class XPrv(ExtendedKey):
         # return self.child(i).to_xpub()  # works always
         return self.to_xpub().child(i)  # works only for non-hardened child keys
 
-    def id(self):
-        return hash160(self.key.to_public().encode(compressed=True))
+    def public_key(self) -> PublicKey:
+        return self.key.to_public()
 
     def key_data(self):
         return self.key.bytes().rjust(33, b'\x00')
@@ -218,24 +309,25 @@ class XPrv(ExtendedKey):
             seed = hex_to_bytes(seed)
         assert 16 <= len(seed) <= 64, 'Seed should be between 128 and 512 bits'
 
-        I = hmac.new(key=b"Bitcoin seed", msg=seed, digestmod=hashlib.sha512).digest()
+        I = hmac_sha512(b"Bitcoin seed", seed)
         I_L, I_R = I[:32], I[32:]
-        if bytes_to_int(I_L) == 0 or bytes_to_int(I_L) > DefaultCurve.order:
+        if bytes_to_int(I_L) == 0 or bytes_to_int(I_L) > N:
             raise KeyDerivationError
 
         key, code = PrivateKey(I_L, network=network), I_R
         return XPrv(key, code, address_type=address_type)
 
     @staticmethod
-    def from_mnemonic(mnemonic: str, pass_phrase='', address_type='P2PKH', network='btc'):
-        seed = Mnemonic.to_seed(mnemonic, pass_phrase)
+    def from_mnemonic(mnemonic: str, pass_phrase='', address_type='P2PKH', network='btc', cache: SeedCache = None):
+        seed = mnemonic_to_seed(mnemonic, pass_phrase, cache)
         return XPrv.from_seed(seed, address_type, network)
 
     def address(self, address_type=None):
-        return self.key.to_public().to_address(address_type or self.type.value, compressed=True)
+        return self.public_key().to_address(address_type or self.type.value, compressed=True)
 
 
 class XPub(ExtendedKey):
+    __slots__ = ()
     root_path = 'M'
 
     def child(self, i: int) -> 'XPub':
@@ -244,16 +336,18 @@ class XPub(ExtendedKey):
         if hardened:
             raise KeyDerivationError('Cannot derive a hardened key from an extended public key')
 
-        I = hmac.new(key=self.code, msg=self.key_data() + int_to_bytes(i).rjust(4, b'\x00'),
-                     digestmod=hashlib.sha512).digest()
+        I = hmac_sha512(self.code, self.key_data() + int_to_bytes(i).rjust(4, b'\x00'))
 
-        I_L, I_R = I[:32], I[32:]
+        I_L, I_R = bytes_to_int(I[:32]), I[32:]
+        if not 0 < I_L < N:
+            raise KeyDerivationError(f'Invalid child key at index {i}')
 
-        key = PrivateKey(I_L).to_public().point + self.key.point
+        key = backends.current().tweak_add(self.key.affine, I_L)
+        if key is None:
+            raise KeyDerivationError(f'Child key at index {i} is the point at infinity')
         ret_code = I_R
         path = self.path + f'/{i}'
 
-        # TODO add point at infinity check
         return XPub(
             PublicKey(key, network=self.key.network),
             ret_code,
@@ -264,8 +358,85 @@ class XPub(ExtendedKey):
             address_type=self.type.value
         )
 
-    def id(self):
-        return hash160(self.key.encode(compressed=True))
+    def derive_range(self, start: int, count: int) -> List['XPub']:
+        """Same as [self.child(i) for i in range(start, start + count)], see derive_many"""
+        self._check_range(start, count, end=1 << 31)
+        return self.derive_many(range(start, start + count))
+
+    def derive_many(self, indexes: Iterable[int]) -> List['XPub']:
+        """
+        Same as [self.child(i) for i in indexes]
+        Parent data is computed once and the backend adds all I_L*G + K_par in one batch
+        (the python backend keeps them in jacobian form and shares a single inversion)
+        """
+        parent = self.fingerprint()
+        network = self.key.network
+        address_type = self.type.value
+        key_data = self.key_data()
+        parent_point = self.key.affine
+
+        indexes, codes, tweaks = list(indexes), [], []
+        for i in indexes:
+            if not 0 <= i < 1 << 31:
+                raise KeyDerivationError(f'Invalid non-hardened index {i}')
+            I = hmac_sha512(self.code, key_data + int_to_bytes(i).rjust(4, b'\x00'))
+            I_L, I_R = bytes_to_int(I[:32]), I[32:]
+            codes.append(I_R)
+            tweaks.append(I_L if 0 < I_L < N else None)  # invalid children are left to XPub.child
+
+        points = backends.current().tweak_add_many(parent_point, [tweak or 0 for tweak in tweaks])
+        children = []
+        for i, code, tweak, point in zip(indexes, codes, tweaks, points):
+            if tweak is None or point is None:
+                children.append(self.child(i))
+                continue
+            children.append(XPub(
+                PublicKey(point, network=network),
+                code,
+                depth=self.depth + 1,
+                i=i,
+                parent=parent,
+                path=self.path + f'/{i}',
+                address_type=address_type
+            ))
+        return children
+
+    def derive_batch(self, start: int, count: int, address_type=None, chunk_size=1 << 16) -> 'AddressBatch':
+        """
+        Children start..start + count as an AddressBatch: the compressed public keys and their hash160s go
+        to flat buffers and no XPub or PublicKey object is created. Work is done in chunks of chunk_size
+        children so memory use beyond the buffers stays bounded.
+        """
+        from hdtools.batch import HASH_SIZE, KEY_SIZE, AddressBatch
+        self._check_range(start, count, end=1 << 31)
+        key_data = self.key_data()
+        parent_point = self.key.affine
+        backend = backends.current()
+        keys = bytearray(count * KEY_SIZE)
+        hashes = bytearray(count * HASH_SIZE)
+
+        for chunk in range(start, start + count, chunk_size):
+            indexes = range(chunk, min(chunk + chunk_size, start + count))
+            tweaks = []
+            for i in indexes:
+                I_L = bytes_to_int(hmac_sha512(self.code, key_data + i.to_bytes(4, 'big'))[:32])
+                if not 0 < I_L < N:
+                    raise KeyDerivationError(f'Invalid child key at index {i}')
+                tweaks.append(I_L)
+            for i, point in zip(indexes, backend.tweak_add_many(parent_point, tweaks)):
+                if point is None:
+                    raise KeyDerivationError(f'Invalid child key at index {i}')
+                x, y = point
+                key = (b'\x03' if y & 1 else b'\x02') + x.to_bytes(32, 'big')
+                position = i - start
+                keys[position * KEY_SIZE:(position + 1) * KEY_SIZE] = key
+                hashes[position * HASH_SIZE:(position + 1) * HASH_SIZE] = hash160(key)
+
+        return AddressBatch(array('I', range(start, start + count)), keys, hashes,
+                            address_type or self.type.value, self.key.network, self.path)
+
+    def public_key(self) -> PublicKey:
+        return self.key
 
     def key_data(self):
         return self.key.encode(compressed=True)
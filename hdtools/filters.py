@@ -0,0 +1,129 @@
+"""
+Compact probabilistic membership filter for watch-only matching of key hashes
+References:
+    https://en.wikipedia.org/wiki/Bloom_filter#Optimal_number_of_hash_functions
+    https://www.eecs.harvard.edu/~michaelm/postscripts/rsa2008.pdf (double hashing)
+
+Items are raw hashes: 20-byte hash160s / script hashes or 32-byte witness programs. A Bloom filter
+has no false negatives, so it can sit in front of the exact AddressIndex: only items that match
+the filter need a lookup.
+"""
+import hashlib
+import math
+import os
+import struct
+from typing import Iterable, List, Optional
+
+from hdtools.address import p2wpkh_p2sh_script
+from hdtools.crypto_utils import hash160
+from hdtools.extended_keys import ExtendedKey
+from hdtools.keys import PublicKey
+from hdtools.parallel import chain_xpub
+
+HEADER = struct.Struct('>4sBQQ16s')  # magic, hash count, bit count, item count, tweak
+MAGIC = b'HDBF'
+
+
+def public_key_hashes(public_key: PublicKey, script=True) -> List[bytes]:
+    """hash160 of the compressed key (P2PKH / P2WPKH) and, if script, of its P2WPKH-P2SH redeem script"""
+    hashes = [hash160(public_key.encode(compressed=True))]
+    if script:
+        hashes.append(hash160(p2wpkh_p2sh_script(public_key)))
+    return hashes
+
+
+class BloomFilter:
+    __slots__ = ('bits', 'size', 'hashes', 'count', 'tweak')
+
+    def __init__(self, capacity: int, fp_rate=0.001, tweak: Optional[bytes] = None):
+        assert capacity > 0, 'capacity must be positive'
+        assert 0 < fp_rate < 1, 'fp_rate must be between 0 and 1'
+        size = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.size = (size + 7) // 8 * 8
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        assert self.hashes < 256, f'fp_rate {fp_rate} needs {self.hashes} hash functions, at most 255 are supported'
+        self.bits = bytearray(self.size // 8)
+        self.count = 0
+        self.tweak = tweak or os.urandom(16)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, item: bytes) -> bool:
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16, key=self.tweak).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item: bytes):
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, items: Iterable[bytes]):
+        for item in items:
+            self.add(item)
+
+    def contains_many(self, items: Iterable[bytes]) -> List[bool]:
+        """
+        Same as [item in self for item in items], still one item at a time (there is no array backend) but
+        about twice as fast: the keyed hash state is set up once and probing stops at the first unset bit
+        """
+        bits, size, probes = self.bits, self.size, range(self.hashes)
+        hasher = hashlib.blake2b(digest_size=16, key=self.tweak)
+        from_bytes = int.from_bytes
+        results = []
+        append = results.append
+        for item in items:
+            h = hasher.copy()
+            h.update(item)
+            digest = from_bytes(h.digest(), 'little')
+            h1, h2 = digest & 0xffffffffffffffff, digest >> 64 | 1  # as in _positions
+            for i in probes:
+                position = (h1 + i * h2) % size
+                if not bits[position >> 3] >> (position & 7) & 1:
+                    append(False)
+                    break
+            else:
+                append(True)
+        return results
+
+    def false_positive_rate(self) -> float:
+        """Expected false positive rate for the number of items added so far"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def add_xkey(self, xkey: ExtendedKey, chain: Optional[int], start: int, count: int, script=True,
+                 chunk_size=10000):
+        """Add the hashes of xkey/chain/i for i in [start, start + count)"""
+        node = chain_xpub(xkey, chain)
+        for chunk in range(start, start + count, chunk_size):
+            for child in node.derive_range(chunk, min(chunk_size, start + count - chunk)):
+                self.update(public_key_hashes(child.key, script))
+
+    @classmethod
+    def from_xkey(cls, xkey: ExtendedKey, chain: Optional[int], start: int, count: int, fp_rate=0.001,
+                  script=True) -> 'BloomFilter':
+        bloom = cls(count * (2 if script else 1), fp_rate)
+        bloom.add_xkey(xkey, chain, start, count, script)
+        return bloom
+
+    def to_bytes(self) -> bytes:
+        return HEADER.pack(MAGIC, self.hashes, self.size, self.count, self.tweak) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, bts: bytes) -> 'BloomFilter':
+        magic, hashes, size, count, tweak = HEADER.unpack_from(bts)
+        assert magic == MAGIC, 'Not a serialized BloomFilter'
+        assert len(bts) == HEADER.size + size // 8, 'Invalid length'
+        bloom = cls.__new__(cls)
+        bloom.hashes, bloom.size, bloom.count, bloom.tweak = hashes, size, count, tweak
+        bloom.bits = bytearray(bts[HEADER.size:])
+        return bloom
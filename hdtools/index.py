@@ -0,0 +1,165 @@
+"""
+Persistent reverse index from key hashes / addresses to their derivation path, backed by sqlite
+
+Every derived public key is recorded under two 21-byte lookup keys (kind byte + hash):
+    * its hash160, which is also the P2PKH hash and the P2WPKH witness program
+    * the hash160 of its P2WPKH-P2SH redeem script
+Rendered addresses are decoded back to these hashes on lookup rather than stored, which keeps
+the index at two fixed-size rows per key. Lookups are O(log n) on the primary key.
+"""
+import sqlite3
+from typing import Iterable, NamedTuple, Optional, Union
+
+from hdtools.address import address_to_hash, p2wpkh_p2sh_script
+from hdtools.base58check import Base58DecodeError
+from hdtools.bech32 import Bech32DecodeError
+from hdtools.crypto_utils import hash160
+from hdtools.extended_keys import ExtendedKey
+from hdtools.keys import PublicKey
+from hdtools.opcodes import AddressType
+from hdtools.parallel import chain_xpub
+
+KEY_HASH = b'\x00'
+SCRIPT_HASH = b'\x01'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS xkeys (
+    id INTEGER PRIMARY KEY,
+    xpub TEXT NOT NULL UNIQUE,
+    network TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chains (
+    xkey INTEGER NOT NULL,
+    chain INTEGER NOT NULL,
+    next_index INTEGER NOT NULL,
+    PRIMARY KEY (xkey, chain)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entries (
+    key BLOB PRIMARY KEY,
+    xkey INTEGER NOT NULL,
+    chain INTEGER NOT NULL,
+    idx INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# raised by address_to_hash for malformed addresses and for valid ones of other types
+INVALID_ADDRESS = (AssertionError, ValueError, Base58DecodeError, Bech32DecodeError)
+
+NO_CHAIN = -1  # keys derived directly from the indexed xpub
+CHUNK_SIZE = 10000
+
+
+class IndexEntry(NamedTuple):
+    xpub: str
+    chain: Optional[int]
+    index: int
+
+    @property
+    def path(self) -> str:
+        return 'M' + ('' if self.chain is None else f'/{self.chain}') + f'/{self.index}'
+
+
+def lookup_keys(public_key: PublicKey) -> tuple:
+    return (
+        KEY_HASH + hash160(public_key.encode(compressed=True)),
+        SCRIPT_HASH + hash160(p2wpkh_p2sh_script(public_key)),
+    )
+
+
+class AddressIndex:
+    """
+    >>> index = AddressIndex('addresses.db')
+    >>> index.extend(account_xpub, chain=0, count=1000)
+    >>> index.lookup('bc1q...')
+    IndexEntry(xpub='zpub...', chain=0, index=15)
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0] // 2
+
+    def close(self):
+        self.connection.close()
+
+    def xkey_id(self, xkey: ExtendedKey) -> int:
+        """Register the extended public key of xkey (private keys are never stored)"""
+        xpub = chain_xpub(xkey, None)
+        encoded = xpub.encode().decode()
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO xkeys (xpub, network) VALUES (?, ?)', (encoded, xpub.key.network)
+            )
+        return self.connection.execute('SELECT id FROM xkeys WHERE xpub = ?', (encoded,)).fetchone()[0]
+
+    def add(self, xkey: ExtendedKey, chain: Optional[int], start: int, count: int):
+        """Index xkey/chain/i for i in [start, start + count), already indexed keys are left untouched"""
+        xkey_id = self.xkey_id(xkey)
+        chain_id = NO_CHAIN if chain is None else chain
+        node = chain_xpub(xkey, chain)
+        with self.connection:
+            for chunk in range(start, start + count, CHUNK_SIZE):
+                children = node.derive_range(chunk, min(CHUNK_SIZE, start + count - chunk))
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO entries (key, xkey, chain, idx) VALUES (?, ?, ?, ?)',
+                    ((key, xkey_id, chain_id, child.i) for child in children for key in lookup_keys(child.key))
+                )
+            self.connection.execute(
+                'INSERT INTO chains (xkey, chain, next_index) VALUES (?, ?, ?) '
+                'ON CONFLICT (xkey, chain) DO UPDATE SET next_index = MAX(next_index, excluded.next_index)',
+                (xkey_id, chain_id, start + count)
+            )
+
+    def next_index(self, xkey: ExtendedKey, chain: Optional[int]) -> int:
+        """First index after the indexed keys of xkey/chain, 0 if none is indexed (the index is not modified)"""
+        row = self.connection.execute(
+            'SELECT chains.next_index FROM chains JOIN xkeys ON xkeys.id = chains.xkey '
+            'WHERE xkeys.xpub = ? AND chains.chain = ?',
+            (chain_xpub(xkey, None).encode().decode(), NO_CHAIN if chain is None else chain)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def extend(self, xkey: ExtendedKey, chain: Optional[int], count: int) -> int:
+        """Append the next count keys of xkey/chain after the highest indexed one, returns the new end"""
+        start = self.next_index(xkey, chain)
+        self.add(xkey, chain, start, count)
+        return start + count
+
+    def lookup_hash(self, hashed: bytes, script=False) -> Optional[IndexEntry]:
+        """Look up a 20-byte key hash / witness program, or a P2WPKH-P2SH script hash if script is True"""
+        row = self.connection.execute(
+            'SELECT xkeys.xpub, entries.chain, entries.idx FROM entries '
+            'JOIN xkeys ON xkeys.id = entries.xkey WHERE entries.key = ?',
+            ((SCRIPT_HASH if script else KEY_HASH) + hashed,)
+        ).fetchone()
+        if row is None:
+            return None
+        xpub, chain, index = row
+        return IndexEntry(xpub, None if chain == NO_CHAIN else chain, index)
+
+    def lookup(self, address: Union[str, bytes], network='btc') -> Optional[IndexEntry]:
+        """
+        Look up a rendered address (P2PKH, P2WPKH-P2SH or P2WPKH)
+        None for addresses that cannot be indexed (e.g. P2WSH or taproot) or cannot be decoded
+        """
+        try:
+            if isinstance(address, bytes):
+                address = address.decode()
+            address_type, hashed = address_to_hash(address, network)
+        except INVALID_ADDRESS:
+            return None
+        return self.lookup_hash(hashed, script=address_type == AddressType.P2SH)
+
+    def lookup_many(self, addresses: Iterable[Union[str, bytes]], network='btc') -> list:
+        return [self.lookup(address, network) for address in addresses]
@@ -0,0 +1,217 @@
+"""
+Opt-in operation counters and timers for the hot paths
+
+Nothing is wrapped until enable() (or the instrumented() context manager) is used: probed functions are
+then replaced, in every hdtools module that references them, by wrappers counting calls and
+accumulating wall time, and restored on disable(). When disabled the original functions are called
+directly, so instrumentation costs nothing.
+
+    >>> with instrumented() as stats:
+    ...     address = (xprv / 84. / 0. / 0. / 0 / 5).address()
+    >>> stats.snapshot()['hmac_sha512']['count'], stats.snapshot()['keys.to_public']['count']
+    (5, 8)
+
+Times are inclusive (ec.scalar_mul includes the ec.point_add calls it makes) and only cover the
+current process, not the workers of hdtools.parallel. Every probed module is imported before patching,
+other hdtools modules imported while instrumentation is enabled bind the wrappers, so their calls are
+counted too: disable() puts the original functions back in every hdtools module.
+
+Patching is process-global and not thread-safe: enable() and disable() are serialized, but the probes
+are installed for every thread at once, so calls made by other threads are counted too, a call running
+while the probes are installed or removed may or may not be counted, and instrumented(fresh=True) in one
+thread resets the counters of all the others. Instrument from a single thread at a time.
+"""
+import functools
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+# (module, attribute, metric), attribute is either a function or Class.method
+PROBES = [
+    ('hdtools.secp256k1', 'mul', 'ec.scalar_mul'),
+    ('hdtools.secp256k1', 'mul_base', 'ec.scalar_mul_base'),
+    ('hdtools.secp256k1', 'add', 'ec.point_add'),
+    ('hdtools.secp256k1', 'add_mixed', 'ec.point_add'),
+    ('hdtools.secp256k1', 'double', 'ec.point_double'),
+    ('hdtools.secp256k1', 'decompress', 'ec.decompress'),
+    ('hdtools.nt_utils', 'mulinv', 'ec.inversion'),
+    ('hdtools.backends', 'Backend.mul_base', 'backend.mul_base'),
+    ('hdtools.backends', 'Backend.tweak_add', 'backend.tweak_add'),
+    ('hdtools.backends', 'Backend.tweak_add_many', 'backend.tweak_add_many'),
+    ('hdtools.backends', 'Backend.decompress', 'backend.decompress'),
+    ('hdtools.backends', 'Backend.sign', 'backend.sign'),
+    ('hdtools.backends', 'Backend.verify', 'backend.verify'),
+    ('hdtools.backends', 'Backend.recover', 'backend.recover'),
+    ('hdtools.crypto_utils', 'hmac_sha512', 'hmac_sha512'),
+    ('hdtools.crypto_utils', 'hash160', 'hash160'),
+    ('hdtools.keys', 'PrivateKey.to_public', 'keys.to_public'),
+    ('hdtools.keys', 'PublicKey.encode', 'keys.public_encode'),
+    ('hdtools.extended_keys', 'ExtendedKey.encode', 'xkey.encode'),
+    ('hdtools.extended_keys', 'ExtendedKey.decode', 'xkey.decode'),
+    ('hdtools.address', 'Address.from_public_key', 'address.render'),
+    ('hdtools.base58check', 'b58encode', 'codec.base58_encode'),
+    ('hdtools.base58check', 'b58decode', 'codec.base58_decode'),
+    ('hdtools.bech32_fast', 'encode', 'codec.bech32_encode'),
+    ('hdtools.bech32_fast', 'decode', 'codec.bech32_decode'),
+]
+
+
+class Stats:
+    """Call counts and cumulative time per metric"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}  # type: Dict[str, int]
+        self._times = {}  # type: Dict[str, int]
+
+    def record(self, metric: str, elapsed_ns: int):
+        with self._lock:
+            self._counts[metric] = self._counts.get(metric, 0) + 1
+            self._times[metric] = self._times.get(metric, 0) + elapsed_ns
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {metric: {'count': count, 'seconds': self._times[metric] / 1e9}
+                    for metric, count in sorted(self._counts.items())}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._times.clear()
+
+
+stats = Stats()
+
+_exporters = []  # callbacks registered with add_exporter
+_patches = []  # (owner, name, original) restored by _uninstall
+_depth = 0
+_lock = threading.Lock()
+
+
+def _wrap(func, metric: str):
+    clock = time.perf_counter_ns
+    record = stats.record
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(metric, clock() - start)
+    wrapper.__wrapped_metric__ = metric
+    return wrapper
+
+
+def _targets(module, attribute: str):
+    """(owner, name, original) for every place a probed attribute has to be replaced"""
+    if '.' in attribute:
+        class_name, name = attribute.split('.')
+        base = getattr(module, class_name)
+        classes, pending = [], [base]
+        while pending:
+            cls = pending.pop()
+            classes.append(cls)
+            pending.extend(cls.__subclasses__())
+        for cls in classes:  # the class and every subclass overriding the method
+            if name in cls.__dict__:
+                yield cls, name, cls.__dict__[name]
+        return
+
+    original = getattr(module, attribute)
+    for other in _hdtools_modules():  # also patch names bound with from ... import ...
+        for name, value in list(vars(other).items()):
+            if value is original:
+                yield other, name, original
+
+
+def _hdtools_modules() -> list:
+    return [module for name, module in list(sys.modules.items())
+            if name.split('.')[0] == 'hdtools' and module is not None and module is not sys.modules[__name__]]
+
+
+def _install():
+    modules = {module_name: importlib.import_module(module_name) for module_name, _, _ in PROBES}
+    for module_name, attribute, metric in PROBES:  # after the imports, so every module binds the originals
+        for owner, name, original in list(_targets(modules[module_name], attribute)):
+            if isinstance(original, (staticmethod, classmethod)):
+                wrapped = type(original)(_wrap(original.__func__, metric))
+            else:
+                wrapped = _wrap(original, metric)
+            _patches.append((owner, name, original))
+            setattr(owner, name, wrapped)
+
+
+def _uninstall():
+    while _patches:
+        owner, name, original = _patches.pop()
+        setattr(owner, name, original)
+    for module in _hdtools_modules():  # imported while enabled, e.g. lazily by PublicKey.to_address
+        for name, value in list(vars(module).items()):
+            if hasattr(value, '__wrapped_metric__'):
+                setattr(module, name, value.__wrapped__)
+
+
+def enable():
+    """Start counting, calls nest: probes stay installed until every enable() has its disable()"""
+    global _depth
+    with _lock:
+        if not _depth:
+            _install()
+        _depth += 1
+
+
+def disable():
+    global _depth
+    with _lock:
+        assert _depth, 'Instrumentation is not enabled'
+        _depth -= 1
+        if not _depth:
+            _uninstall()
+
+
+def is_enabled() -> bool:
+    return _depth > 0
+
+
+def snapshot() -> Dict[str, dict]:
+    """metric -> {'count': calls, 'seconds': cumulative time} since the last reset"""
+    return stats.snapshot()
+
+
+def reset():
+    stats.reset()
+
+
+def add_exporter(exporter: Callable[[Dict[str, dict]], None]):
+    """Register a callback receiving snapshots, e.g. to push them to a metrics system"""
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter: Callable[[Dict[str, dict]], None]):
+    _exporters.remove(exporter)
+
+
+def export() -> Dict[str, dict]:
+    """Send the current snapshot to every exporter and return it"""
+    data = snapshot()
+    for exporter in _exporters:
+        exporter(data)
+    return data
+
+
+@contextmanager
+def instrumented(fresh=True, export_on_exit=False):
+    """Enable instrumentation for a block, fresh resets the counters first"""
+    if fresh:
+        reset()
+    enable()
+    try:
+        yield stats
+    finally:
+        disable()
+        if export_on_exit:
+            export()
@@ -1,56 +1,76 @@
-from ecdsa import SigningKey, SECP256k1 as DefaultCurve
-from ecdsa.ellipticcurve import Point
-
-from base58 import b58decode, b58encode
+from hdtools.base58check import b58decode, encode_check, checksum as base58_checksum
 
 from hdtools.conversions import hex_to_bytes, bytes_to_hex, int_to_bytes, bytes_to_int, hex_to_int
 from hdtools.message import Message as BaseMessage
 from hdtools.network import get_network_attr
 
-from hdtools.nt_utils import modsqrt
-from hdtools.crypto_utils import sha256
+from hdtools import backends, secp256k1
+from hdtools.signature import SignatureDecodeError, decode_compact, decode_der, encode_compact, encode_der
+
+
+def __getattr__(name):
+    if name == 'DefaultCurve':  # ecdsa is only imported when it is actually used
+        from ecdsa import SECP256k1
+        return SECP256k1
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
-def f(x, curve=DefaultCurve.curve):
+def f(x, curve=None):
     """
     Compute y**2 = x^3 + ax + b in field FP
     :param x: x
-    :param curve: The curve
+    :param curve: The curve (an ecdsa CurveFp), secp256k1 by default
     :return: result of relation
     """
+    if curve is None:
+        return (x ** 3 + secp256k1.A * x + secp256k1.B) % secp256k1.P
     return (x ** 3 + curve.a() * x + curve.b()) % curve.p()
 
 
 def ecdsa_point_creator(x, y):
+    from ecdsa import SECP256k1
+    from ecdsa.ellipticcurve import Point
     return Point(
-        curve=DefaultCurve.curve,
+        curve=SECP256k1.curve,
         x=x,
         y=y
     )
 
 
 class PrivateKey(BaseMessage):
+    __slots__ = ('network', '_key', '_public')
+
     def __init__(self, bts, network='btc'):
+        """No curve arithmetic is done here, the public key and the ecdsa SigningKey are created on first use"""
         super().__init__(bts)
+        assert len(bts) == 32 and 0 < bytes_to_int(bts) < secp256k1.N, 'Invalid private key'
         self.network = network
-        self._key = SigningKey.from_string(
-            bts,
-            curve=DefaultCurve
-        )
+        self._key = None
+        self._public = None
+
+    @classmethod
+    def from_int(cls, i):
+        return cls(i.to_bytes(32, 'big'))
 
     @staticmethod
     def random(network='btc'):
-        return PrivateKey(
-            SigningKey.generate(curve=DefaultCurve).to_string(),
-            network=network
-        )
+        import secrets
+        return PrivateKey((secrets.randbelow(secp256k1.N - 1) + 1).to_bytes(32, 'big'), network=network)
+
+    @property
+    def signing_key(self):
+        """The key as an ecdsa SigningKey"""
+        if self._key is None:
+            from ecdsa import SigningKey, SECP256k1
+            self._key = SigningKey.from_string(self.bytes(), curve=SECP256k1)
+        return self._key
 
     @staticmethod
     def from_wif(wif: str, network='btc') -> "PrivateKey":
         bts = b58decode(wif)
         network_byte, key, checksum = bts[0:1], bts[1:-4], bts[-4:]
 
-        assert sha256(sha256(network_byte + key))[:4] == checksum, 'Invalid Checksum'
+        assert base58_checksum(network_byte + key) == checksum, 'Invalid Checksum'
         assert network_byte == get_network_attr('wif', network), 'Invalid Network byte'
 
         if key.endswith(b'\x01'):
@@ -62,37 +82,66 @@ class PrivateKey(BaseMessage):
 
     def wif(self, compressed=False):
         extended = get_network_attr('wif', self.network) + self.bytes() + (b'\x01' if compressed else b'')
-        hashed = sha256(sha256(extended))
-        checksum = hashed[:4]
-        return b58encode(extended + checksum)
+        return encode_check(extended).encode()
 
     def to_public(self):
-        point = self._key.get_verifying_key().pubkey.point
-        return PublicKey(point, self.network)
+        """The public key is computed once, network may still be changed after construction"""
+        if self._public is None:
+            self._public = PublicKey(backends.current().mul_base(self.int()), self.network)
+        elif self._public.network != self.network:
+            self._public = PublicKey(self._public.affine, self.network)
+        return self._public
 
     def __repr__(self):
         return f"PrivateKey({self.msg})"
 
     def sign_hash(self, digest):
-        return self._key.sign_digest(digest)
+        """64-byte r || s signature of a 32-byte digest, see sign"""
+        return encode_compact(*backends.current().sign(self.int(), digest))
+
+    def sign(self, digest: bytes) -> bytes:
+        """Deterministic (RFC6979) low-S DER signature of a 32-byte digest"""
+        return encode_der(*backends.current().sign(self.int(), digest))
+
+    def sign_many(self, digests) -> list:
+        """DER signatures of many digests, the per-key setup is done once"""
+        return [encode_der(r, s) for r, s in backends.current().sign_many(self.int(), digests)]
 
 
 class PublicKey:
+    __slots__ = ('network', '_point', '_compressed', '_uncompressed')
+
     def __init__(self, point, network):
+        """point is an affine (x, y) tuple (or an ecdsa Point), None if only the compressed encoding is known"""
         self.network = network
-        self.point = point
+        self._point = point if point is None or isinstance(point, tuple) else (point.x(), point.y())
+        self._compressed = None
+        self._uncompressed = None
+
+    @property
+    def affine(self) -> tuple:
+        if self._point is None:  # created lazily from its compressed encoding
+            point = backends.current().decompress(bytes_to_int(self._compressed[1:]), odd=self._compressed[0] == 3)
+            assert point is not None, 'Point is not on the curve'
+            self._point = point
+        return self._point
+
+    @property
+    def point(self):
+        """The point as an ecdsa Point"""
+        return ecdsa_point_creator(*self.affine)
 
     def __eq__(self, other):
-        return self.point == other.point
+        return self.affine == other.affine
 
     def __repr__(self):
         return f"PublicKey({self.x()}, {self.y()})"
 
     def x(self):
-        return self.point.x()
+        return self.affine[0]
 
     def y(self):
-        return self.point.y()
+        return self.affine[1]
 
     @staticmethod
     def from_private(private, network='btc'):
@@ -101,38 +150,62 @@ class PublicKey:
         return private_key.to_public()
 
     @staticmethod
-    def decode(key: bytes, network='btc'):  # TODO Easier implementation
+    def decode(key: bytes, network='btc', lazy=False):
+        """With lazy, compressed keys are only decompressed (and checked to be on the curve) on first use"""
         if key.startswith(b'\x04'):  # uncompressed key
             assert len(key) == 65, 'An uncompressed public key must be 65 bytes long'
             x, y = bytes_to_int(key[1:33]), bytes_to_int(key[33:])
+            assert x < secp256k1.P and y < secp256k1.P and y * y % secp256k1.P == f(x), 'Point is not on the curve'
         else:  # compressed key
             assert len(key) == 33, 'A compressed public key must be 33 bytes long'
-            x = bytes_to_int(key[1:])
-            root = modsqrt(f(x), DefaultCurve.curve.p())
-            if key.startswith(b'\x03'):  # odd root
-                y = root if root % 2 == 1 else -root % DefaultCurve.curve.p()
-            elif key.startswith(b'\x02'):  # even root
-                y = root if root % 2 == 0 else -root % DefaultCurve.curve.p()
-            else:
-                assert False, 'Wrong key format'
+            assert key[0] in (2, 3), 'Wrong key format'
+            if lazy:
+                public = PublicKey(None, network=network)
+                public._compressed = bytes(key)
+                return public
+            point = backends.current().decompress(bytes_to_int(key[1:]), odd=key[0] == 3)
+            assert point is not None, 'Point is not on the curve'
+            x, y = point
 
-        return PublicKey(ecdsa_point_creator(x, y), network=network)
+        return PublicKey((x, y), network=network)
+
+    @staticmethod
+    def decode_many(keys, network='btc') -> list:
+        """Decode an iterable of encoded (compressed or uncompressed) public keys"""
+        decode = PublicKey.decode
+        return [decode(key, network) for key in keys]
 
     @staticmethod
     def from_hex(hex_string: str, network='btc'):
         return PublicKey.decode(hex_to_bytes(hex_string), network)
 
-    def encode(self, compressed=False) -> bytes:  # TODO Maybe easier Implementation
+    def encode(self, compressed=False) -> bytes:
         if compressed:
-            if self.y() & 1:  # odd root
-                return b'\x03' + int_to_bytes(self.x()).rjust(32, b'\x00')
-            else:  # even root
-                return b'\x02' + int_to_bytes(self.x()).rjust(32, b'\x00')
-        return b'\x04' + int_to_bytes(self.x()).rjust(32, b'\x00') + int_to_bytes(self.y()).rjust(32, b'\x00')
+            if self._compressed is None:
+                prefix = b'\x03' if self.y() & 1 else b'\x02'  # odd or even root
+                self._compressed = prefix + int_to_bytes(self.x()).rjust(32, b'\x00')
+            return self._compressed
+        if self._uncompressed is None:
+            self._uncompressed = b'\x04' + int_to_bytes(self.x()).rjust(32, b'\x00') + \
+                                 int_to_bytes(self.y()).rjust(32, b'\x00')
+        return self._uncompressed
 
     def hex(self, compressed=False) -> str:
         return bytes_to_hex(self.encode(compressed=compressed))
 
+    def verify(self, digest: bytes, sig: bytes) -> bool:
+        """
+        Check a DER (or 64-byte r || s) signature of a 32-byte digest, high-S signatures are accepted
+        Digests of any other length give False, whatever the backend
+        """
+        if len(digest) != 32:
+            return False
+        try:
+            r, s = decode_compact(sig) if len(sig) == 64 else decode_der(sig)
+        except SignatureDecodeError:
+            return False
+        return backends.current().verify(self.affine, digest, r, s)
+
     def to_address(self, address_type, compressed=None):
         from hdtools.address import Address
         if compressed is not False and address_type == 'P2PKH':
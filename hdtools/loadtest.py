@@ -0,0 +1,139 @@
+"""
+Load test for hdtools.server, runs fully offline
+Run with: python -m hdtools.loadtest [--clients 8] [--requests 200] [--port PORT | --unix PATH] [--workers N]
+
+Without --port or --unix a server is started in this process on a free local port. Every client thread
+keeps one connection and sends a fixed, seeded mix of requests on the accounts of a test seed:
+overlapping 20-address windows (so concurrent clients hit the same ranges), single derivations,
+decodes and validations. Reports requests/sec, per-method latency percentiles and the server's cache
+and coalescing statistics.
+"""
+import argparse
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from hdtools.bench import SEED, percentile
+from hdtools.server import Client, Service, make_server
+
+ACCOUNTS = 4
+WINDOW = 20
+MIX = (('addresses', 4), ('derive', 3), ('decode', 1), ('validate', 2))
+
+
+def accounts(count=ACCOUNTS) -> Tuple[List[str], List[str]]:
+    """Encoded account xpubs m/84'/0'/a' of the test seed and a few of their addresses"""
+    from hdtools.extended_keys import XPrv
+    master = XPrv.from_seed(SEED, address_type='P2WPKH')
+    xpubs = [(master / 84. / 0. / float(a)).to_xpub() for a in range(count)]
+    return [xpub.encode().decode() for xpub in xpubs], [xpub.derive('0/0').address() for xpub in xpubs]
+
+
+def _requests(rng: random.Random, xpubs: List[str], addresses: List[str], count: int) -> List[Tuple[str, dict]]:
+    methods, weights = zip(*MIX)
+    requests = []
+    for method in rng.choices(methods, weights, k=count):
+        xkey = rng.choice(xpubs)
+        if method == 'addresses':
+            params = {'xkey': xkey, 'path': str(rng.randrange(2)), 'start': rng.randrange(10) * WINDOW,
+                      'count': WINDOW}
+        elif method == 'derive':
+            params = {'xkey': xkey, 'path': f'{rng.randrange(2)}/{rng.randrange(1000)}'}
+        elif method == 'decode':
+            params = {'xkey': xkey}
+        elif rng.random() < 0.5:
+            params = {'address': rng.choice(addresses)}
+        else:
+            params = {'address': rng.choice(addresses)[:-1] + 'q'}  # mostly an invalid checksum
+        requests.append((method, params))
+    return requests
+
+
+def run(clients=8, requests=200, host='127.0.0.1', port: Optional[int] = None, unix: Optional[str] = None,
+        workers=None, seed=0) -> dict:
+    """Run the load test and return its results, a server is started in this process if port and unix are None"""
+    server = service = None
+    if port is None and unix is None:
+        service = Service(workers=workers)
+        server = make_server(service, host, 0)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    xpubs, addresses = accounts()
+    plans = [_requests(random.Random(seed + i), xpubs, addresses, requests) for i in range(clients)]
+    latencies = {method: [] for method, _ in MIX}  # type: Dict[str, List[int]]
+    connects = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def client(plan):
+        timings = []
+        with Client(host, port, unix) as connection:
+            start.wait()
+            for method, params in plan:
+                begin = time.perf_counter_ns()
+                connection.call(method, **params)
+                timings.append((method, time.perf_counter_ns() - begin))
+        with lock:
+            for method, elapsed in timings:
+                latencies[method].append(elapsed)
+            connects.append(connection.connects)
+
+    threads = [threading.Thread(target=client, args=(plan,)) for plan in plans]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    with Client(host, port, unix) as connection:
+        stats = connection.stats()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+    methods = {}
+    for method, timings in latencies.items():
+        timings.sort()
+        if timings:
+            methods[method] = {'count': len(timings), 'p50_ms': percentile(timings, 0.5) / 1e6,
+                               'p90_ms': percentile(timings, 0.9) / 1e6, 'p99_ms': percentile(timings, 0.99) / 1e6}
+    return {
+        'clients': clients,
+        'requests': clients * requests,
+        'seconds': elapsed,
+        'requests_per_sec': clients * requests / elapsed,
+        'connections': sum(connects),
+        'methods': methods,
+        'server': stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='test a running server instead of starting one')
+    parser.add_argument('--unix', help='test a running server on this Unix socket')
+    parser.add_argument('--workers', type=int, help='worker processes of the server started by the test')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the request mix')
+    args = parser.parse_args(argv)
+
+    result = run(args.clients, args.requests, args.host, args.port, args.unix, args.workers, args.seed)
+    print(f"{result['requests']} requests from {result['clients']} clients over {result['connections']} "
+          f"connections in {result['seconds']:.2f} s: {result['requests_per_sec']:,.0f} requests/s")
+    print(f"{'method':<10} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for method, timings in result['methods'].items():
+        print(f"{method:<10} {timings['count']:>7} {timings['p50_ms']:>9.2f} {timings['p90_ms']:>9.2f} "
+              f"{timings['p99_ms']:>9.2f}")
+    server = result['server']
+    print(f"coalesced: {server['coalesced']}, node cache: {server['node_cache']}, key cache: {server['key_cache']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,34 @@
+"""
+Messages and Bitcoin signed messages (signmessage / verifymessage)
+References:
+    https://github.com/bitcoin/bips/blob/master/bip-0137.mediawiki
+
+Signatures are 65-byte compact recoverable signatures in base64: a header byte, then r and s.
+Verification recovers the public key from (r, s, recid) and compares its hash160 with the one in
+the address, so public keys are never stored and only one multi-scalar multiplication is needed.
+"""
 from hdtools.conversions import int_to_bytes, hex_to_bytes, bytes_to_int, bytes_to_hex
 
 import base64
+import binascii
 from hashlib import sha256 as hash_function
+from typing import Iterable, List, Tuple, Union
+
+from hdtools import backends
+from hdtools.crypto_utils import hash160, sha256
+from hdtools.opcodes import AddressType
+
+MAGIC = b'\x18Bitcoin Signed Message:\n'
+HEADER_OFFSETS = {  # BIP137 header byte is offset + recid, P2PKH with an uncompressed key uses 27
+    AddressType.P2PKH: 31,
+    AddressType.P2WPKH_P2SH: 35,
+    AddressType.P2WPKH: 39,
+}
 
 
 class Message:
     """Basic data class with useful constructors and methods"""
+    __slots__ = ('msg',)
 
     def __init__(self, bts):
         self.msg = bts
@@ -65,3 +88,71 @@ class Message:
 
     def hash(self):
         return hash_function(self.msg).hexdigest()
+
+
+def varint(i: int) -> bytes:
+    if i < 0xfd:
+        return bytes([i])
+    elif i <= 0xffff:
+        return b'\xfd' + i.to_bytes(2, 'little')
+    elif i <= 0xffffffff:
+        return b'\xfe' + i.to_bytes(4, 'little')
+    return b'\xff' + i.to_bytes(8, 'little')
+
+
+def message_digest(message: Union[str, bytes]) -> bytes:
+    """Double SHA256 of the message with the Bitcoin Signed Message prefix"""
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    return sha256(sha256(MAGIC + varint(len(message)) + message))
+
+
+def sign_message(private_key, message: Union[str, bytes], address_type='P2PKH', compressed=True) -> str:
+    """
+    Base64 signature of message by private_key (a keys.PrivateKey) for an address of address_type
+    An uncompressed key can only be used for P2PKH
+    """
+    address_type = AddressType(address_type)
+    assert address_type in HEADER_OFFSETS, f'Cannot sign messages for {address_type.value} addresses'
+    assert compressed or address_type == AddressType.P2PKH, 'Segwit addresses need a compressed key'
+    r, s, recid = backends.current().sign_recoverable(private_key.int(), message_digest(message))
+    header = HEADER_OFFSETS[address_type] + recid - (0 if compressed else 4)
+    return base64.b64encode(bytes([header]) + r.to_bytes(32, 'big') + s.to_bytes(32, 'big')).decode()
+
+
+def verify_message(address: str, message: Union[str, bytes], signature: str, network='btc') -> bool:
+    """
+    Check a signature made by the key of a P2PKH, P2WPKH-P2SH or P2WPKH address
+    The type bits of the header are not enforced, only the compressed flag: some wallets sign segwit
+    addresses with P2PKH headers.
+    """
+    from hdtools.address import address_to_hash, p2wpkh_p2sh_script
+    from hdtools.keys import PublicKey
+
+    try:
+        sig = base64.b64decode(signature, validate=True)
+        address_type, hashed = address_to_hash(address, network)
+    except (binascii.Error, ValueError, AssertionError):
+        return False
+    if len(sig) != 65 or not 27 <= sig[0] <= 42:
+        return False
+    compressed = sig[0] >= 31
+    recid = (sig[0] - 27) & 3
+    r, s = int.from_bytes(sig[1:33], 'big'), int.from_bytes(sig[33:], 'big')
+
+    point = backends.current().recover(message_digest(message), r, s, recid)
+    if point is None:
+        return False
+    x, y = point
+    if not compressed:
+        key = b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+        return address_type == AddressType.P2PKH and hash160(key) == hashed
+    key = bytes([3 if y & 1 else 2]) + x.to_bytes(32, 'big')
+    if address_type == AddressType.P2SH:
+        return hash160(p2wpkh_p2sh_script(PublicKey.decode(key, network, lazy=True))) == hashed
+    return hash160(key) == hashed
+
+
+def verify_messages(items: Iterable[Tuple[str, Union[str, bytes], str]], network='btc') -> List[bool]:
+    """verify_message of (address, message, signature) triples, one result per item"""
+    return [verify_message(address, message, signature, network) for address, message, signature in items]
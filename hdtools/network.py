@@ -70,3 +70,24 @@ networks = {
 
 def get_network_attr(attr, network='btc'):
     return networks[NETWORK(network)][attr]
+
+
+def build_extended_versions():
+    """
+    version bytes -> (network, address type, is private) for every extended key version
+    Version bytes that are shared between different kinds of keys are left out as they cannot be resolved
+    """
+    table, ambiguous = {}, set()
+    for network, attrs in networks.items():
+        for attr, is_private in (('extended_prv', True), ('extended_pub', False)):
+            for address_type, version in attrs[attr].items():
+                info = (network.value, address_type, is_private)
+                if table.get(version, info) != info:
+                    ambiguous.add(version)
+                table[version] = info
+    for version in ambiguous:
+        del table[version]
+    return table
+
+
+extended_versions = build_extended_versions()
@@ -1,6 +1,6 @@
 # Number Theory utils
-import random
-import secrets
+# random and secrets are only needed for prime generation and are imported there, keeping
+# the import of the secp256k1 arithmetic (which needs mulinv) light
 from math import gcd
 
 
@@ -10,6 +10,8 @@ def miller_rabin(n, runs=40):
     # See http://stackoverflow.com/questions/6325576/how-many-iterations-of-rabin-miller-should-i-use-for-cryptographic-safe-primes
     # for justification
 
+    import random
+
     if n == 2:
         return True
 
@@ -36,6 +38,8 @@ def miller_rabin(n, runs=40):
 
 
 def random_prime(bits):
+    import secrets
+
     while True:
         n = secrets.randbits(bits)
         if miller_rabin(n):
@@ -43,6 +47,8 @@ def random_prime(bits):
 
 
 def random_coprime(n):
+    import random
+
     assert n > 1
     while True:
         e = random.randrange(1, n)
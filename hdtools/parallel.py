@@ -0,0 +1,101 @@
+"""
+Multi-process address generation, mnemonic processing and signature verification
+Work is split into chunks that run in a process pool (or any executor) through map_chunks, results are
+returned in input order. For addresses only the encoded extended public key of the chain node is sent
+with every chunk, not pickled key objects.
+"""
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, Union
+
+from hdtools.extended_keys import ExtendedKey, XPrv, XPub
+from hdtools.keys import PublicKey
+from hdtools.seed import mnemonic_to_seed
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def map_chunks(func: Callable, chunks: Sequence[tuple], workers=None, executor: Executor = None) -> list:
+    """
+    Concatenated results of func(*chunk) for every chunk, in order
+    Runs in executor if one is given, else in the calling process for a single chunk or worker, else in a
+    process pool of workers processes (defaults to the CPU count) created for this call.
+    """
+    workers = workers or os.cpu_count() or 1
+    if executor is None and (workers == 1 or len(chunks) <= 1):
+        return [result for chunk in chunks for result in func(*chunk)]
+    if executor is not None:
+        return [result for chunk in executor.map(func, *zip(*chunks)) for result in chunk]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [result for chunk in pool.map(func, *zip(*chunks)) for result in chunk]
+
+
+def _address_chunk(encoded: bytes, network: str, start: int, count: int, address_type: str) -> List[str]:
+    return XPub.decode(encoded, network, lazy=True).address_range(start, count, address_type)
+
+
+def chain_xpub(xkey: ExtendedKey, chain: Optional[int]) -> XPub:
+    """The extended public key addresses are generated from: xkey/chain, or xkey itself if chain is None"""
+    node = xkey if chain is None else xkey.child(chain)
+    return node.to_xpub() if isinstance(node, XPrv) else node
+
+
+def generate_addresses(xkey: ExtendedKey, chain: Optional[int], start: int, count: int, address_type=None,
+                       workers=None, chunk_size=DEFAULT_CHUNK_SIZE, executor: Executor = None) -> List[str]:
+    """
+    Addresses of xkey/chain/i for i in [start, start + count), in index order
+    Work is split into chunks of chunk_size indexes, see map_chunks
+    """
+    assert chunk_size > 0, 'chunk_size must be positive'
+    assert 0 <= start and 0 <= count and start + count <= 1 << 31, f'Invalid range: start={start}, count={count}'
+    node = chain_xpub(xkey, chain)
+    address_type = address_type or node.type.value
+    encoded, network = node.encode(), node.key.network
+    chunks = [(encoded, network, s, min(chunk_size, start + count - s), address_type)
+              for s in range(start, start + count, chunk_size)]
+    return map_chunks(_address_chunk, chunks, workers, executor)
+
+
+def _seed_chunk(pairs: List[Tuple[str, str]]) -> List[bytes]:
+    return [mnemonic_to_seed(mnemonic, passphrase) for mnemonic, passphrase in pairs]
+
+
+def seeds_from_mnemonics(pairs: Iterable[Tuple[str, str]], workers=None, chunk_size=16,
+                         executor: Executor = None) -> List[bytes]:
+    """BIP39 seeds of (mnemonic, passphrase) pairs, in order, see map_chunks"""
+    pairs = list(pairs)
+    chunks = [(pairs[i:i + chunk_size],) for i in range(0, len(pairs), chunk_size)]
+    return map_chunks(_seed_chunk, chunks, workers, executor)
+
+
+def masters_from_mnemonics(pairs: Iterable[Tuple[str, str]], address_type='P2PKH', network='btc',
+                           **kwargs) -> List[XPrv]:
+    """
+    Master keys of (mnemonic, passphrase) pairs, in order
+    PBKDF2 runs in the workers, the (cheap) master key derivation in the calling process
+    """
+    return [XPrv.from_seed(seed, address_type, network) for seed in seeds_from_mnemonics(pairs, **kwargs)]
+
+
+def _verify_chunk(items: List[Tuple[bytes, bytes, bytes]]) -> List[bool]:
+    results = []
+    for key, digest, sig in items:
+        try:
+            public_key = PublicKey.decode(key)
+        except AssertionError:
+            results.append(False)
+            continue
+        results.append(public_key.verify(digest, sig))
+    return results
+
+
+def verify_many(items: Iterable[Tuple[Union[PublicKey, bytes], bytes, bytes]], workers=None, chunk_size=256,
+                executor: Executor = None) -> List[bool]:
+    """
+    Verify (public key, digest, signature) triples, returns one result per item, in order
+    Public keys may be PublicKey objects or encodings, invalid keys and signatures give False.
+    """
+    items = [(key.encode(compressed=True) if isinstance(key, PublicKey) else bytes(key), digest, sig)
+             for key, digest, sig in items]
+    chunks = [(items[i:i + chunk_size],) for i in range(0, len(items), chunk_size)]
+    return map_chunks(_verify_chunk, chunks, workers, executor)
@@ -0,0 +1,108 @@
+"""
+BIP44 gap-limit discovery of used addresses
+References:
+    https://github.com/bitcoin/bips/blob/master/bip-0044.mediawiki#account-discovery
+    https://github.com/bitcoin/bips/blob/master/bip-0044.mediawiki#address-gap-limit
+
+The "used" oracle can be:
+    * a container (set, frozenset, dict, ...) of used addresses
+    * a callable taking one address and returning a bool
+    * a callable taking a list of addresses and returning a list of bools (pass batch=True)
+Derivation of the next batch runs while the oracle checks the current one.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from hdtools.extended_keys import ExtendedKey, XPrv
+from hdtools.opcodes import AddressType
+from hdtools.parallel import chain_xpub
+
+RECEIVE, CHANGE = 0, 1
+DEFAULT_GAP_LIMIT = 20
+
+PURPOSE_ADDRESS_TYPES = {
+    44: AddressType.P2PKH.value,
+    49: AddressType.P2WPKH_P2SH.value,
+    84: AddressType.P2WPKH.value,
+}
+
+
+class ChainScan(NamedTuple):
+    chain: Optional[int]
+    used: List[Tuple[int, str]]  # (index, address) of every used address
+    scanned: int  # number of indexes checked, starting at 0
+
+    @property
+    def last_used(self) -> Optional[int]:
+        return self.used[-1][0] if self.used else None
+
+    @property
+    def next_unused(self) -> int:
+        return 0 if not self.used else self.used[-1][0] + 1
+
+
+def batch_oracle(used, batch=False) -> Callable[[List[str]], List[bool]]:
+    """Normalize a used-address oracle into a callable taking and returning lists"""
+    if batch:
+        assert callable(used), 'A batch oracle must be callable'
+        return used
+    if callable(used):
+        return lambda addresses: [bool(used(address)) for address in addresses]
+    return lambda addresses: [address in used for address in addresses]
+
+
+def scan_chain(xkey: ExtendedKey, chain: Optional[int], used, gap_limit=DEFAULT_GAP_LIMIT, batch_size=None,
+               batch=False, address_type=None) -> ChainScan:
+    """Check xkey/chain/0, xkey/chain/1, ... until gap_limit consecutive addresses are unused"""
+    assert gap_limit > 0, 'gap_limit must be positive'
+    oracle = batch_oracle(used, batch)
+    node = chain_xpub(xkey, chain)
+    address_type = address_type or node.type.value
+    batch_size = batch_size or gap_limit
+
+    def derive(start):
+        return node.address_range(start, min(batch_size, (1 << 31) - start), address_type)
+
+    found, gap, start = [], 0, 0
+    addresses = derive(start)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        while addresses:
+            pending = pool.submit(oracle, addresses)
+            next_start = start + len(addresses)
+            next_addresses = derive(next_start)  # derived while the oracle is busy
+
+            flags = pending.result()
+            assert len(flags) == len(addresses), 'Oracle returned a wrong number of results'
+            for index, (address, flag) in enumerate(zip(addresses, flags), start):
+                if flag:
+                    found.append((index, address))
+                    gap = 0
+                else:
+                    gap += 1
+                if gap >= gap_limit:
+                    return ChainScan(chain, found, index + 1)
+
+            start, addresses = next_start, next_addresses
+    return ChainScan(chain, found, start)
+
+
+def scan_account(xkey: ExtendedKey, used, chains=(RECEIVE, CHANGE), **kwargs) -> Dict[int, ChainScan]:
+    """Scan the receive and change chains of an account key, kwargs are passed to scan_chain"""
+    return {chain: scan_chain(xkey, chain, used, **kwargs) for chain in chains}
+
+
+def scan_accounts(master: XPrv, used, purpose=44, coin=0, max_accounts=None, address_type=None,
+                  **kwargs) -> List[Dict[int, ChainScan]]:
+    """
+    BIP44 account discovery: scan m/purpose'/coin'/0', m/purpose'/coin'/1', ... and stop at
+    the first account without used addresses (which is not included in the result)
+    """
+    address_type = address_type or PURPOSE_ADDRESS_TYPES.get(purpose, master.type.value)
+    accounts = []
+    while max_accounts is None or len(accounts) < max_accounts:
+        account = master.derive(f"m/{purpose}'/{coin}'/{len(accounts)}'")
+        scans = scan_account(account, used, address_type=address_type, **kwargs)
+        if not any(scan.used for scan in scans.values()):
+            break
+        accounts.append(scans)
+    return accounts
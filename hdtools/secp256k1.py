@@ -0,0 +1,338 @@
+"""
+Jacobian-coordinate arithmetic and ECDSA over secp256k1
+References:
+    https://www.secg.org/sec2-v2.pdf
+    https://hyperelliptic.org/EFD/g1p/auto-shortw-jacobian-0.html
+    https://tools.ietf.org/html/rfc6979
+"""
+import hashlib
+import hmac
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from hdtools.nt_utils import mulinv
+
+P = 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+A = 0
+B = 7
+G = (
+    0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
+    0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+)
+
+Affine = Tuple[int, int]
+Jacobian = Tuple[int, int, int]
+
+INFINITY = (0, 1, 0)  # Z == 0 marks the point at infinity
+
+
+def decompress(x: int, odd: bool) -> Optional[Affine]:
+    """
+    Recover y from x and its parity, None if x is not on the curve
+    P = 3 mod 4 so the square root is a single exponentiation: y = (x^3 + 7)^((P + 1) / 4)
+    """
+    if not 0 <= x < P:
+        return None
+    y2 = (x * x * x + B) % P
+    y = pow(y2, (P + 1) // 4, P)
+    if y * y % P != y2:
+        return None
+    if y & 1 != odd:
+        y = P - y
+    return x, y
+
+
+def to_jacobian(point: Affine) -> Jacobian:
+    return point[0], point[1], 1
+
+
+def to_affine(point: Jacobian) -> Optional[Affine]:
+    """Convert a jacobian point to affine, None for the point at infinity"""
+    x, y, z = point
+    if not z:
+        return None
+    z_inv = mulinv(z, P)
+    z_inv2 = z_inv * z_inv % P
+    return x * z_inv2 % P, y * z_inv2 * z_inv % P
+
+
+def batch_to_affine(points: Iterable[Jacobian]) -> List[Optional[Affine]]:
+    """
+    Convert many jacobian points to affine sharing one modular inversion (Montgomery's trick)
+    Points at infinity are returned as None
+    """
+    points = list(points)
+    prefix = []
+    acc = 1
+    for _, _, z in points:
+        prefix.append(acc)
+        if z:
+            acc = acc * z % P
+
+    inv = mulinv(acc, P)
+    result = [None] * len(points)
+    for idx in range(len(points) - 1, -1, -1):
+        x, y, z = points[idx]
+        if not z:
+            continue
+        z_inv = inv * prefix[idx] % P
+        inv = inv * z % P
+        z_inv2 = z_inv * z_inv % P
+        result[idx] = (x * z_inv2 % P, y * z_inv2 * z_inv % P)
+    return result
+
+
+def double(point: Jacobian) -> Jacobian:
+    """dbl-2009-l"""
+    x, y, z = point
+    if not z or not y:
+        return INFINITY
+    a = x * x % P
+    b = y * y % P
+    c = b * b % P
+    d = 2 * ((x + b) ** 2 - a - c) % P
+    e = 3 * a
+    f = e * e % P
+    x3 = (f - 2 * d) % P
+    y3 = (e * (d - x3) - 8 * c) % P
+    z3 = 2 * y * z % P
+    return x3, y3, z3
+
+
+def add(p1: Jacobian, p2: Jacobian) -> Jacobian:
+    """add-1998-cmo-2"""
+    x1, y1, z1 = p1
+    x2, y2, z2 = p2
+    if not z1:
+        return p2
+    if not z2:
+        return p1
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    h = (u2 - u1) % P
+    r = (s2 - s1) % P
+    if not h:
+        return double(p1) if not r else INFINITY
+    hh = h * h % P
+    hhh = h * hh % P
+    v = u1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    y3 = (r * (v - x3) - s1 * hhh) % P
+    z3 = z1 * z2 * h % P
+    return x3, y3, z3
+
+
+def add_mixed(p1: Jacobian, p2: Affine) -> Jacobian:
+    """Add an affine point to a jacobian one (madd-2004-hmv)"""
+    x1, y1, z1 = p1
+    x2, y2 = p2
+    if not z1:
+        return x2, y2, 1
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+    if not h:
+        return double(p1) if not r else INFINITY
+    hh = h * h % P
+    hhh = h * hh % P
+    v = x1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    y3 = (r * (v - x3) - y1 * hhh) % P
+    z3 = z1 * h % P
+    return x3, y3, z3
+
+
+def negate(point: Affine) -> Affine:
+    return point[0], -point[1] % P
+
+
+def wnaf(k: int, width: int) -> List[int]:
+    """Width-w non-adjacent form of k, least significant digit first"""
+    digits = []
+    window = 1 << width
+    while k:
+        if k & 1:
+            digit = k & (window - 1)
+            if digit >= window >> 1:
+                digit -= window
+            k -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        k >>= 1
+    return digits
+
+
+def odd_multiples(point: Affine, width: int) -> List[Affine]:
+    """[P, 3P, 5P, ..., (2^(w-1) - 1)P] in affine form"""
+    twice = double(to_jacobian(point))
+    multiples = [to_jacobian(point)]
+    for _ in range((1 << (width - 2)) - 1):
+        multiples.append(add(multiples[-1], twice))
+    return batch_to_affine(multiples)
+
+
+def mul(point: Affine, k: int, width: int = 5) -> Jacobian:
+    """Variable-base scalar multiplication using wNAF, the result stays in jacobian form"""
+    k %= N
+    if not k:
+        return INFINITY
+    table = odd_multiples(point, width)
+    negated = [negate(p) for p in table]
+    result = INFINITY
+    for digit in reversed(wnaf(k, width)):
+        result = double(result)
+        if digit > 0:
+            result = add_mixed(result, table[digit >> 1])
+        elif digit < 0:
+            result = add_mixed(result, negated[-digit >> 1])
+    return result
+
+
+BASE_WINDOW = 8
+_base_table = None
+
+
+def base_table() -> List[List[Affine]]:
+    """
+    Fixed-window table of G: table[i][j - 1] = j * 2^(w*i) * G
+    Built once on first use, mul_base then needs only ceil(256 / w) mixed additions and no doublings
+    """
+    global _base_table
+    if _base_table is None:
+        size = 1 << BASE_WINDOW
+        windows = (N.bit_length() + BASE_WINDOW - 1) // BASE_WINDOW
+        points = []
+        base = to_jacobian(G)
+        for _ in range(windows):
+            row = [base]
+            for _ in range(size - 2):
+                row.append(add(row[-1], base))
+            points.extend(row)
+            base = add(row[-1], base)
+        flat = batch_to_affine(points)
+        _base_table = [flat[i:i + size - 1] for i in range(0, len(flat), size - 1)]
+    return _base_table
+
+
+def mul_base(k: int, result: Jacobian = INFINITY) -> Jacobian:
+    """Fixed-base scalar multiplication k*G (+ result), the result stays in jacobian form"""
+    k %= N
+    mask = (1 << BASE_WINDOW) - 1
+    for row in base_table():
+        if not k:
+            break
+        digit = k & mask
+        if digit:
+            result = add_mixed(result, row[digit - 1])
+        k >>= BASE_WINDOW
+    return result
+
+
+def mul_add(u1: int, point: Affine, u2: int) -> Jacobian:
+    """
+    u1*G + u2*point in a single accumulator (Shamir's trick)
+    The G multiples come from the fixed-base table, which needs no doublings, so they are added on top of
+    the wNAF chain of point instead of being interleaved with it.
+    """
+    return mul_base(u1, mul(point, u2))
+
+
+def tweak_add(point: Affine, k: int) -> Optional[Affine]:
+    """point + k*G, None for the point at infinity"""
+    return to_affine(add_mixed(mul_base(k), point))
+
+
+def tweak_add_many(point: Affine, scalars: Iterable[int]) -> List[Optional[Affine]]:
+    """[point + k*G for k in scalars] sharing a single inversion"""
+    return batch_to_affine([add_mixed(mul_base(k), point) for k in scalars])
+
+
+def rfc6979_prefix(secret: int):
+    """HMAC state of the first RFC6979 step up to the digest, it only depends on the key"""
+    return hmac.new(b'\x00' * 32, b'\x01' * 32 + b'\x00' + secret.to_bytes(32, 'big'), hashlib.sha256)
+
+
+def rfc6979_nonces(secret: int, digest: bytes, prefix=None) -> Iterator[int]:
+    """Deterministic nonce candidates for (secret, digest) with HMAC-SHA256"""
+    x = secret.to_bytes(32, 'big')
+    h1 = (int.from_bytes(digest, 'big') % N).to_bytes(32, 'big')
+    v = b'\x01' * 32
+    k = (prefix or rfc6979_prefix(secret)).copy()
+    k.update(h1)
+    k = k.digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    k = hmac.new(k, v + b'\x01' + x + h1, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    while True:
+        v = hmac.new(k, v, hashlib.sha256).digest()
+        candidate = int.from_bytes(v, 'big')
+        if 0 < candidate < N:
+            yield candidate
+        k = hmac.new(k, v + b'\x00', hashlib.sha256).digest()
+        v = hmac.new(k, v, hashlib.sha256).digest()
+
+
+def sign_recoverable(secret: int, digest: bytes, prefix=None) -> Tuple[int, int, int]:
+    """
+    ECDSA signature (r, s, recid) of a 32-byte digest with an RFC6979 nonce, s is normalized to the lower half
+    recid encodes the parity of R.y (bit 0) and whether R.x overflowed N (bit 1), see recover
+    k*G goes through the fixed-base table, prefix (see rfc6979_prefix) can be reused across digests
+    """
+    assert len(digest) == 32, 'Digest must be 32 bytes long'
+    z = int.from_bytes(digest, 'big')
+    for nonce in rfc6979_nonces(secret, digest, prefix):
+        x, y = to_affine(mul_base(nonce))
+        r = x % N
+        if not r:
+            continue
+        s = mulinv(nonce, N) * (z + r * secret) % N
+        if not s:
+            continue
+        recid = (y & 1) | (2 if x >= N else 0)
+        if s > N - s:
+            s, recid = N - s, recid ^ 1  # -s signs with -R
+        return r, s, recid
+
+
+def sign(secret: int, digest: bytes, prefix=None) -> Tuple[int, int]:
+    return sign_recoverable(secret, digest, prefix)[:2]
+
+
+def sign_many(secret: int, digests: Iterable[bytes]) -> List[Tuple[int, int]]:
+    prefix = rfc6979_prefix(secret)
+    return [sign(secret, digest, prefix) for digest in digests]
+
+
+def recover(digest: bytes, r: int, s: int, recid: int) -> Optional[Affine]:
+    """
+    Public key of a recoverable signature, None if there is none
+    Q = r^-1 (s*R - e*G), computed as a single mul_add
+    """
+    if not (0 < r < N and 0 < s < N and 0 <= recid < 4):
+        return None
+    point = decompress(r + N if recid & 2 else r, bool(recid & 1))
+    if point is None:
+        return None
+    e = int.from_bytes(digest, 'big')
+    w = mulinv(r, N)
+    return to_affine(mul_add(-e * w % N, point, s * w % N))
+
+
+def verify(point: Affine, digest: bytes, r: int, s: int) -> bool:
+    if not (0 < r < N and 0 < s < N):
+        return False
+    e = int.from_bytes(digest, 'big')
+    w = mulinv(s, N)
+    x, _, z = mul_add(e * w % N, point, r * w % N)
+    if not z:
+        return False
+    # x / z^2 == r (mod N) without an inversion: the affine x is either r or r + N
+    zz = z * z % P
+    return x == r * zz % P or (r + N < P and x == (r + N) * zz % P)
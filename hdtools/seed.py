@@ -0,0 +1,107 @@
+"""
+BIP39 mnemonic to seed
+References:
+    https://github.com/bitcoin/bips/blob/master/bip-0039.mediawiki#from-mnemonic-to-seed
+
+PBKDF2-HMAC-SHA512 always runs in C through hashlib.pbkdf2_hmac. SeedCache optionally keeps
+recently computed seeds in memory, in bytearrays that are zeroed when they are evicted.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+PBKDF2_ROUNDS = 2048
+
+
+def normalize(text) -> str:
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return unicodedata.normalize('NFKD', text)
+
+
+def mnemonic_to_seed(mnemonic: str, passphrase='', cache: Optional['SeedCache'] = None) -> bytes:
+    """Same as Mnemonic.to_seed: the checksum of the mnemonic is not verified"""
+    if cache is not None:
+        seed = cache.get(mnemonic, passphrase)
+        if seed is not None:
+            return seed
+    seed = hashlib.pbkdf2_hmac(
+        'sha512',
+        normalize(mnemonic).encode('utf-8'),
+        ('mnemonic' + normalize(passphrase)).encode('utf-8'),
+        PBKDF2_ROUNDS
+    )
+    if cache is not None:
+        cache.put(mnemonic, passphrase, seed)
+    return seed
+
+
+class SeedCache:
+    """
+    Bounded LRU cache of (mnemonic, passphrase) -> seed
+    Entries are keyed by an HMAC under a random per-cache key, so mnemonics are never stored.
+    Seeds are kept in bytearrays and overwritten with zeros on eviction and clear(); copies
+    returned to callers are ordinary bytes and are not covered.
+    """
+
+    def __init__(self, max_size=1024):
+        assert max_size >= 0, 'max_size must be non-negative'
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._key = os.urandom(32)
+        self._seeds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._seeds)
+
+    def _digest(self, mnemonic, passphrase) -> bytes:
+        data = normalize(mnemonic).encode('utf-8') + b'\x00' + normalize(passphrase).encode('utf-8')
+        return hmac.new(self._key, data, hashlib.sha256).digest()
+
+    def get(self, mnemonic: str, passphrase='') -> Optional[bytes]:
+        digest = self._digest(mnemonic, passphrase)
+        with self._lock:
+            seed = self._seeds.get(digest)
+            if seed is None:
+                self.misses += 1
+                return None
+            self._seeds.move_to_end(digest)
+            self.hits += 1
+            return bytes(seed)
+
+    def put(self, mnemonic: str, passphrase: str, seed: bytes):
+        if not self.max_size:
+            return
+        digest = self._digest(mnemonic, passphrase)
+        with self._lock:
+            if digest in self._seeds:
+                self._wipe(self._seeds.pop(digest))
+            self._seeds[digest] = bytearray(seed)
+            while len(self._seeds) > self.max_size:
+                self._wipe(self._seeds.popitem(last=False)[1])
+
+    def resize(self, max_size: int):
+        assert max_size >= 0, 'max_size must be non-negative'
+        with self._lock:
+            self.max_size = max_size
+            while len(self._seeds) > max_size:
+                self._wipe(self._seeds.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            for seed in self._seeds.values():
+                self._wipe(seed)
+            self._seeds.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._seeds), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def _wipe(seed: bytearray):
+        seed[:] = bytes(len(seed))
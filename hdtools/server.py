@@ -0,0 +1,368 @@
+"""
+Local address derivation server, so that several processes share decoded keys and derived nodes
+Run with: python -m hdtools.server [--host 127.0.0.1] [--port 8732 | --unix PATH] [--workers N]
+
+Requests are JSON objects POSTed to /<method> over HTTP/1.1, connections are kept alive:
+    derive     {"xkey", "path", "address_type"?} -> {"xkey", "path", "address"}
+    addresses  {"xkey", "start", "count", "path"?, "address_type"?} -> {"addresses"}
+    decode     {"xkey"} -> {"network", "address_type", "private", "depth", "i", "parent",
+                            "fingerprint", "chain_code", "public_key"}
+    validate   {"address", "network"?} or {"xkey"} -> {"valid", "type" or "error"}
+GET /stats returns the request counters and cache statistics. Invalid requests get status 400 and
+{"error": message}, unexpected failures (e.g. a broken process pool) status 500. The server is meant for
+local use: it has no authentication and derives from extended private keys too, so it binds to 127.0.0.1
+(or a Unix socket) by default.
+
+Decoded extended public keys are kept in an LRU cache and their intermediate nodes in a NodeCache, both
+shared by every client. Extended private keys are decoded again for every request and never cached.
+Identical requests in flight at the same time are computed once. Address ranges run in a process pool,
+split into chunks, the other methods are cheap once their nodes are cached and run in the connection
+threads. Client keeps one connection open, see hdtools.loadtest for a load test.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from typing import Callable, Dict, Hashable, List, Optional
+
+from hdtools.address import address_to_hash
+from hdtools.base58check import Base58DecodeError
+from hdtools.bech32 import Bech32DecodeError
+from hdtools.derivation import NodeCache
+from hdtools.extended_keys import ExtendedKey, KeyDerivationError, XPrv
+from hdtools.parallel import DEFAULT_CHUNK_SIZE, generate_addresses
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8732
+MAX_COUNT = 100000  # addresses per request
+
+# errors caused by the request, answered with status 400
+INVALID_REQUEST = (AssertionError, TypeError, ValueError, KeyError, KeyDerivationError, Base58DecodeError,
+                   Bech32DecodeError)
+
+
+class ServerError(Exception):
+    pass
+
+
+def _check_strings(optional=False, **params):
+    for name, value in params.items():
+        assert isinstance(value, str) or optional and value is None, f'{name} must be a string'
+
+
+class InFlight:
+    """Runs identical concurrent calls once: callers arriving while a key is computed wait for its result"""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._futures = {}  # type: Dict[Hashable, Future]
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, func: Callable):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+
+class Service:
+    """The server's methods, independent of the transport"""
+    METHODS = ('derive', 'addresses', 'decode', 'validate')
+
+    def __init__(self, executor: Executor = None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, cache_size=1024):
+        """Address ranges run in executor, a process pool of workers processes is created if None"""
+        self._own_executor = executor is None
+        self.executor = executor or ProcessPoolExecutor(workers or os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.node_cache = NodeCache(cache_size)
+        self.inflight = InFlight()
+        self.counts = dict.fromkeys(self.METHODS + ('errors',), 0)
+        self.cache_size = cache_size
+        self.key_hits = 0
+        self.key_misses = 0
+        self._keys = OrderedDict()  # (xkey, network) -> decoded extended public key
+        self._lock = threading.Lock()
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown()
+
+    def _decode(self, xkey: str, network: Optional[str]) -> ExtendedKey:
+        with self._lock:
+            key = self._keys.get((xkey, network))
+            if key is not None:
+                self._keys.move_to_end((xkey, network))
+                self.key_hits += 1
+                return key
+            self.key_misses += 1
+        key = ExtendedKey.decode(xkey, network)
+        if not isinstance(key, XPrv):  # no secrets in the caches
+            with self._lock:
+                self._keys[(xkey, network)] = key
+                while len(self._keys) > self.cache_size:
+                    self._keys.popitem(last=False)
+        return key
+
+    def node(self, xkey: str, path: Optional[str] = None, network=None) -> ExtendedKey:
+        _check_strings(xkey=xkey)
+        _check_strings(path=path, network=network, optional=True)
+        key = self._decode(xkey, network)
+        if not path:
+            return key
+        return key.derive(path, cache=None if isinstance(key, XPrv) else self.node_cache)
+
+    def derive(self, xkey: str, path: str, address_type=None) -> dict:
+        _check_strings(path=path)
+        _check_strings(address_type=address_type, optional=True)
+        node = self.node(xkey, path)
+        return {'xkey': node.encode().decode(), 'path': node.path, 'address': node.address(address_type)}
+
+    def addresses(self, xkey: str, start: int, count: int, path=None, address_type=None) -> dict:
+        assert all(isinstance(n, int) and not isinstance(n, bool) for n in (start, count)), \
+            'start and count must be integers'
+        assert start >= 0, 'start must be non-negative'
+        assert 0 <= count <= MAX_COUNT, f'count must be between 0 and {MAX_COUNT}'
+        _check_strings(address_type=address_type, optional=True)
+        node = self.node(xkey, path)
+        return {'addresses': generate_addresses(node, None, start, count, address_type,
+                                                chunk_size=self.chunk_size, executor=self.executor)}
+
+    def decode(self, xkey: str) -> dict:
+        key = self.node(xkey)
+        return {
+            'network': key.key.network,
+            'address_type': key.type.value,
+            'private': isinstance(key, XPrv),
+            'depth': key.depth,
+            'i': key.i,
+            'parent': key.parent.hex(),
+            'fingerprint': key.fingerprint().hex(),
+            'chain_code': key.code.hex(),
+            'public_key': key.public_key().encode(compressed=True).hex(),
+        }
+
+    def validate(self, address=None, xkey=None, network='btc') -> dict:
+        assert (address is None) != (xkey is None), 'Give either an address or an xkey'
+        try:
+            _check_strings(address=address, xkey=xkey, network=network, optional=True)
+            if xkey is not None:
+                key = self.node(xkey)
+                return {'valid': True, 'type': 'xprv' if isinstance(key, XPrv) else 'xpub', 'network': key.key.network}
+            address_type, _ = address_to_hash(address, network)
+            return {'valid': True, 'type': address_type.value, 'network': network}
+        except INVALID_REQUEST as e:
+            return {'valid': False, 'error': str(e) or e.__class__.__name__}
+
+    def handle(self, method: str, body: bytes):
+        """(HTTP status, response) for a JSON request body"""
+        if method not in self.METHODS:
+            return 404, {'error': f'Unknown method {method!r}'}
+        try:
+            params = json.loads(body or b'{}')
+            assert isinstance(params, dict), 'The request must be a JSON object'
+            key = (method, json.dumps(params, sort_keys=True))
+            response = self.inflight.run(key, lambda: getattr(self, method)(**params))
+        except INVALID_REQUEST as e:
+            self._count('errors')
+            return 400, {'error': str(e) or e.__class__.__name__}
+        except Exception as e:
+            self._count('errors')
+            return 500, {'error': f'{e.__class__.__name__}: {e}'}
+        self._count(method)
+        return 200, response
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self) -> dict:
+        return {
+            'requests': dict(self.counts),
+            'coalesced': self.inflight.coalesced,
+            'node_cache': self.node_cache.stats(),
+            'key_cache': {'size': len(self._keys), 'max_size': self.cache_size,
+                          'hits': self.key_hits, 'misses': self.key_misses},
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            assert length >= 0
+        except (ValueError, AssertionError):
+            self.close_connection = True  # the end of the body is unknown
+            self._send(400, {'error': 'Invalid Content-Length'})
+            return
+        body = self.rfile.read(length)
+        self._send(*self.server.service.handle(self.path.strip('/'), body))
+
+    def do_GET(self):
+        if self.path.strip('/') == 'stats':
+            self._send(200, self.server.service.stats())
+        else:
+            self._send(404, {'error': f'Unknown path {self.path!r}'})
+
+    def _send(self, status: int, response: dict):
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHandler(Handler):
+    disable_nagle_algorithm = False  # TCP_NODELAY does not apply to Unix sockets
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service: Service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix: str = None, verbose=False):
+    """A threading server for service on host:port (port 0 picks a free one) or on the Unix socket unix"""
+    if unix is not None:
+        if os.path.exists(unix):
+            os.unlink(unix)
+        server = UnixServer(unix, UnixHandler)
+    else:
+        server = TCPServer((host, port), Handler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class Client:
+    """Client keeping one connection to the server open, not thread safe: use one per thread"""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix: str = None, timeout=60):
+        self.host, self.port, self.unix, self.timeout = host, port, unix, timeout
+        self.connects = 0
+        self._connection = None  # type: Optional[http.client.HTTPConnection]
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _request(self, method: str, path: str, body: bytes = None) -> dict:
+        for attempt in range(2):  # the server may have closed an idle connection, every method is idempotent
+            if self._connection is None:
+                if self.unix is not None:
+                    self._connection = UnixHTTPConnection(self.unix, self.timeout)
+                else:
+                    self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.connects += 1
+            try:
+                self._connection.request(method, path, body, {'Content-Type': 'application/json'})
+                response = self._connection.getresponse()
+                data = json.loads(response.read())
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise ServerError(data.get('error', f'HTTP {response.status}'))
+        return data
+
+    def call(self, method: str, **params) -> dict:
+        return self._request('POST', '/' + method, json.dumps(params).encode())
+
+    def derive(self, xkey: str, path: str, address_type=None) -> dict:
+        return self.call('derive', xkey=xkey, path=path, address_type=address_type)
+
+    def addresses(self, xkey: str, start: int, count: int, path=None, address_type=None) -> List[str]:
+        return self.call('addresses', xkey=xkey, start=start, count=count, path=path,
+                         address_type=address_type)['addresses']
+
+    def decode(self, xkey: str) -> dict:
+        return self.call('decode', xkey=xkey)
+
+    def validate(self, address=None, xkey=None, network='btc') -> dict:
+        return self.call('validate', address=address, xkey=xkey, network=network)
+
+    def stats(self) -> dict:
+        return self._request('GET', '/stats')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, help='processes deriving address ranges (default: CPU count)')
+    parser.add_argument('--cache-size', type=int, default=1024, help='decoded keys and intermediate nodes kept')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    service = Service(workers=args.workers, cache_size=args.cache_size)
+    server = make_server(service, args.host, args.port, args.unix, args.verbose)
+    address = args.unix or f'{args.host}:{server.server_address[1]}'
+    print(f'hdtools server listening on {address}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
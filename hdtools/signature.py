@@ -0,0 +1,62 @@
+"""
+ECDSA signature encodings
+References:
+    https://github.com/bitcoin/bips/blob/master/bip-0066.mediawiki
+    https://github.com/bitcoin/bips/blob/master/bip-0062.mediawiki#low-s-values-in-signatures
+"""
+from typing import Tuple
+
+from hdtools.secp256k1 import N
+
+
+class SignatureDecodeError(Exception):
+    pass
+
+
+def _der_int(i: int) -> bytes:
+    bts = i.to_bytes((i.bit_length() + 8) // 8, 'big')  # keeps a leading zero when the high bit is set
+    return b'\x02' + bytes([len(bts)]) + bts
+
+
+def encode_der(r: int, s: int) -> bytes:
+    body = _der_int(r) + _der_int(s)
+    return b'\x30' + bytes([len(body)]) + body
+
+
+def decode_der(sig: bytes) -> Tuple[int, int]:
+    """Strict (BIP66) DER decoding"""
+    if len(sig) < 8 or len(sig) > 72 or sig[0] != 0x30 or sig[1] != len(sig) - 2:
+        raise SignatureDecodeError('Invalid DER signature')
+    values = []
+    offset = 2
+    for _ in range(2):
+        if offset + 2 > len(sig) or sig[offset] != 0x02:
+            raise SignatureDecodeError('Invalid DER integer')
+        length = sig[offset + 1]
+        value = sig[offset + 2:offset + 2 + length]
+        if not length or len(value) != length or value[0] & 0x80 or (length > 1 and not value[0] and
+                                                                     not value[1] & 0x80):
+            raise SignatureDecodeError('Invalid DER integer')
+        values.append(int.from_bytes(value, 'big'))
+        offset += 2 + length
+    if offset != len(sig):
+        raise SignatureDecodeError('Leftover bytes')
+    return values[0], values[1]
+
+
+def encode_compact(r: int, s: int) -> bytes:
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+
+def decode_compact(sig: bytes) -> Tuple[int, int]:
+    if len(sig) != 64:
+        raise SignatureDecodeError('A compact signature must be 64 bytes long')
+    return int.from_bytes(sig[:32], 'big'), int.from_bytes(sig[32:], 'big')
+
+
+def is_low_s(s: int) -> bool:
+    return s <= N // 2
+
+
+def normalize_s(s: int) -> int:
+    return min(s, N - s)
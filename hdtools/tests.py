@@ -2,7 +2,9 @@ from unittest import TestCase, main as test_main
 
 from hdtools.extended_keys import XPrv, XPub
 from hdtools.keys import PrivateKey, PublicKey
+from hdtools.derivation import NodeCache, node_cache, parse_path
 from hdtools.opcodes import AddressType
+from hdtools import secp256k1
 
 
 class TestKeys(TestCase):
@@ -33,6 +35,74 @@ class TestKeys(TestCase):
             PublicKey.from_hex('03b82761f2482254b93fdf45f26c5d00bd51883fb7cd143080318c5be9746a5f5f')
         )
 
+    def test_lazy_key_material(self):
+        from hdtools.instrument import instrumented
+        from hdtools.extended_keys import XPrv
+        master = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+        with instrumented() as stats:
+            private = PrivateKey.from_wif('L2AnMo4KYaNTKFwgd2ZSsgcxAo8QSwJ9QYSiBSm44a4WZrwPKTum')
+            account = master.derive("m/44'/0'/0'", cache=None)
+        # only the fingerprints of m, m/44' and m/44'/0' need public keys
+        self.assertEqual(stats.snapshot()['backend.mul_base']['count'], 3)
+        self.assertEqual(private.signing_key.get_verifying_key().to_string('compressed'),
+                         private.to_public().encode(compressed=True))
+        self.assertEqual(account.key.signing_key.to_string(), account.key.bytes())
+        with self.assertRaises(AssertionError):
+            PrivateKey(bytes(32))
+
+    def test_decode(self):
+        keys = [PrivateKey(k.to_bytes(32, 'big')).to_public() for k in (1, 2, 3, 0xdeadbeef)]
+        encoded = [key.encode(compressed=True) for key in keys] + [key.encode() for key in keys]
+        self.assertEqual(PublicKey.decode_many(encoded), keys + keys)
+
+        with self.assertRaises(AssertionError):
+            PublicKey.decode(b'\x02' + bytes(32))  # x = 0 is not on the curve
+        with self.assertRaises(AssertionError):
+            PublicKey.decode(b'\x05' + keys[0].encode(compressed=True)[1:])
+
+    def test_sign(self):
+        """RFC6979 vector, private key 1 and sha256(b'Satoshi Nakamoto')"""
+        import hashlib
+        from hdtools import backends
+        from hdtools.signature import decode_der, encode_der
+
+        key = PrivateKey((1).to_bytes(32, 'big'))
+        digest = hashlib.sha256(b'Satoshi Nakamoto').digest()
+        self.assertEqual(
+            decode_der(key.sign(digest)),
+            (0x934b1ea10a4b3c1757e2b0c017d0b6143ce3c9a7e6a4a49860d7a6ab210ee3d8,
+             0x2442ce9d2b916064108014783e923ec36b49743e2ffa1c4496f01a512aafd9e5)
+        )
+        digests = [hashlib.sha256(bytes([i])).digest() for i in range(4)]
+        self.assertEqual(key.sign_many(digests), [key.sign(digest) for digest in digests])
+
+        public = key.to_public()
+        r, s = decode_der(key.sign(digest))
+        for name in backends.available_backends():
+            with backends.using(name):
+                self.assertTrue(public.verify(digest, key.sign(digest)))
+                self.assertTrue(public.verify(digest, encode_der(r, secp256k1.N - s)))  # high-S
+                self.assertFalse(public.verify(digests[0], key.sign(digest)))
+
+    def test_sign_message(self):
+        from hdtools import backends
+        from hdtools.message import sign_message, verify_message
+
+        key = PrivateKey.from_wif('L2AnMo4KYaNTKFwgd2ZSsgcxAo8QSwJ9QYSiBSm44a4WZrwPKTum')
+        public = key.to_public()
+        for name in backends.available_backends():
+            with backends.using(name):
+                for address_type in ('P2PKH', 'P2WPKH-P2SH', 'P2WPKH'):
+                    signature = sign_message(key, 'proof of ownership', address_type)
+                    address = public.to_address(address_type)
+                    self.assertTrue(verify_message(address, 'proof of ownership', signature))
+                    self.assertFalse(verify_message(address, 'proof of 0wnership', signature))
+
+        signature = sign_message(key, b'message', compressed=False)
+        self.assertTrue(verify_message(public.to_address('P2PKH', compressed=False), b'message', signature))
+        self.assertFalse(verify_message(public.to_address('P2PKH'), b'message', signature))
+        self.assertFalse(verify_message(public.to_address('P2PKH'), b'message', 'not base64!'))
+
     def test_address_creation(self):
         """
         Test address creation
@@ -66,6 +136,47 @@ class TestKeys(TestCase):
         )
 
 
+class TestSecp256k1(TestCase):
+    def test_scalar_multiplication(self):
+        from ecdsa import SECP256k1
+
+        for k in (1, 2, 3, 255, 256, 2 ** 128 + 1, secp256k1.N - 1):
+            expected = SECP256k1.generator * k
+            self.assertEqual(secp256k1.to_affine(secp256k1.mul_base(k)), (expected.x(), expected.y()))
+
+            point = (expected.x(), expected.y())
+            self.assertEqual(
+                secp256k1.to_affine(secp256k1.mul(point, 0xdeadbeef)),
+                secp256k1.to_affine(secp256k1.mul_base(k * 0xdeadbeef))
+            )
+
+        self.assertEqual(secp256k1.mul_base(secp256k1.N), secp256k1.INFINITY)
+        self.assertEqual(secp256k1.mul(secp256k1.G, secp256k1.N), secp256k1.INFINITY)
+
+
+class TestBase58(TestCase):
+    def test_base58check(self):
+        from hdtools import base58check
+
+        self.assertEqual(base58check.b58encode(b'\x00\x00hello world'), '11StV1DL6CwTryKyV')
+        self.assertEqual(base58check.b58decode('11StV1DL6CwTryKyV'), b'\x00\x00hello world')
+        self.assertEqual(base58check.b58encode(b''), '')
+
+        address = '1PMycacnJaSqwwJqjawXBErnLsZ7RkXUAs'
+        payload = base58check.decode_check(address, base58check.ADDRESS_LENGTH)
+        self.assertEqual(base58check.encode_check(payload), address)
+        self.assertEqual(
+            base58check.validate_many([address, address[:-1] + 't', address[:-1], '0' + address[1:], address.encode()],
+                                      base58check.ADDRESS_LENGTH),
+            [True, False, False, False, True]
+        )
+        with self.assertRaises(base58check.Base58DecodeError):
+            base58check.decode_check(address[:-1] + 't')
+
+        xpub = 'xpub661MyMwAqRbcFtXgS5sYJABqqG9YLmC4Q1Rdap9gSE8NqtwybGhePY2gZ29ESFjqJoCu1Rupje8YtGqsefD265TMg7usUDFdp6W1EGMcet8'
+        self.assertEqual(base58check.encode_check_many(base58check.decode_check_many([xpub], 82)), [xpub])
+
+
 class TestExtendedKeys(TestCase):
     """
     All test-cases can be checked on https://iancoleman.io/bip39/
@@ -119,6 +230,633 @@ class TestExtendedKeys(TestCase):
             'bc1qrxxtlul9j3p95wrt33zg7vdf74skujnhnghaey'
         )
 
+        for address_type in ('P2PKH', 'P2WPKH-P2SH', 'P2WPKH'):
+            self.assertIsInstance(M.address(address_type), str)
+            self.assertIsInstance(M.to_xpub().address(address_type), str)
+
+    def test_decode(self):
+        from hdtools.extended_keys import ExtendedKey
+
+        M = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+        T = XPrv.from_seed('000102030405060708090a0b0c0d0e0f', network='btct', address_type='P2WPKH')
+        keys = [M, M.to_xpub(), M / 0. / 1, (M / 0. / 1).to_xpub(), T / 1, (T / 1).to_xpub()]
+        encoded = [key.encode() for key in keys]
+
+        decoded = ExtendedKey.decode_many(encoded, lazy=True)
+        self.assertEqual([type(key) for key in decoded], [type(key) for key in keys])
+        self.assertEqual([key.encode() for key in decoded], encoded)
+        self.assertEqual(decoded[3].child(5).encode(), keys[3].child(5).encode())
+        self.assertEqual(decoded[5].key.network, 'btct')
+        self.assertEqual(XPub.decode(encoded[3]).path, 'M/x/1')
+
+        invalid = encoded[1][:-1] + b'1'
+        results = ExtendedKey.decode_many([encoded[0], invalid, 'x0'], strict=False)
+        self.assertEqual([key and key.encode() for key in results], [encoded[0], None, None])
+        with self.assertRaises(AssertionError):
+            ExtendedKey.decode(encoded[5])  # testnet key on mainnet
+
+    def test_memoization(self):
+        M = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+        for obj in (M, M.key, M.to_xpub(), M.key.to_public()):
+            self.assertFalse(hasattr(obj, '__dict__'))
+
+        self.assertIs(M.key.to_public(), M.key.to_public())
+        self.assertIs(M.id(), M.id())
+        self.assertEqual(M.fingerprint(), M.to_xpub().fingerprint())
+
+        M.key.network = 'btct'
+        self.assertEqual(M.key.to_public().network, 'btct')
+
+    def test_derive_path(self):
+        self.assertEqual(parse_path("m/84'/0h/0H/1/15"), (2 ** 31 + 84, 2 ** 31, 2 ** 31, 1, 15))
+        self.assertEqual(parse_path('M'), ())
+        for invalid in ('m/', 'm/x', "m/1''", 'm/2147483648', 'm/-1'):
+            with self.assertRaises(AssertionError):
+                parse_path(invalid)
+
+        M = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+        cache = NodeCache(max_size=3)
+        for i in range(3):
+            self.assertEqual(
+                M.derive(f"m/84'/0'/0'/0/{i}", cache=cache).encode(),
+                (M / 84. / 0. / 0. / 0 / i).encode()
+            )
+        self.assertEqual(cache.stats(), {'size': 3, 'max_size': 3, 'hits': 8, 'misses': 4, 'evictions': 1})
+        self.assertEqual(M.derive("m/1'/2", cache=None).encode(), (M / 1. / 2).encode())
+        self.assertEqual(M.to_xpub().derive('M/0/1').encode(), (M / 0 / 1).to_xpub().encode())
+        self.assertIs(M.derive('m'), M)
+
+        account = M / 84. / 0. / 0.
+        self.assertEqual(account.derive('0/1').encode(), (account / 0 / 1).encode())
+        with self.assertRaises(AssertionError):
+            account.derive('m/0/1')
+
+        node_cache.clear()
+        M.derive("m/84'/0'/0'/0/0")
+        self.assertEqual(len(node_cache), 0)  # private nodes stay out of the shared cache
+        account.to_xpub().derive('0/0')
+        self.assertEqual(len(node_cache), 1)
+
+    def test_derive_range(self):
+        M = XPrv.from_mnemonic('lemon child success once board usual cigar '
+                               'buffalo video cheese kitten onion build axis dose', address_type='P2WPKH')
+        account = M / 84. / 0. / 0.
+
+        xpub = (account / 0).to_xpub()
+        children = xpub.derive_range(5, 10)
+        self.assertEqual([child.encode() for child in children], [xpub.child(i).encode() for i in range(5, 15)])
+        self.assertEqual(xpub.address_range(0, 1), ['bc1qrxxtlul9j3p95wrt33zg7vdf74skujnhnghaey'])
+
+        self.assertEqual(
+            [child.encode() for child in account.derive_range(0, 3)],
+            [account.child(i).encode() for i in range(3)]
+        )
+        self.assertEqual(
+            [child.encode() for child in account.derive_range(2 ** 31, 2)],
+            [account.child(i).encode() for i in range(2 ** 31, 2 ** 31 + 2)]
+        )
+
+    def test_child_key_leading_zero(self):
+        master = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+        child = master.child(121)  # private key 00ea2260...
+        self.assertEqual(child.key.bytes()[:1], b'\x00')
+        self.assertEqual(len(child.key.bytes()), 32)
+        self.assertEqual(XPrv.decode(child.encode()).encode(), child.encode())
+        self.assertEqual(child.to_xpub().encode(), master.to_xpub().child(121).encode())
+        self.assertEqual(master.derive_range(121, 1)[0].encode(), child.encode())
+
+    def test_derive_batch(self):
+        import io
+        from hdtools.batch import AddressBatch
+        M = XPrv.from_mnemonic('lemon child success once board usual cigar '
+                               'buffalo video cheese kitten onion build axis dose', address_type='P2WPKH')
+        xpub = (M / 84. / 0. / 0. / 0).to_xpub()
+        batch = xpub.derive_batch(0, 40, chunk_size=16)
+        addresses = xpub.address_range(0, 40)
+        self.assertEqual(list(batch), addresses)
+        self.assertEqual(batch[0], 'bc1qrxxtlul9j3p95wrt33zg7vdf74skujnhnghaey')
+        self.assertEqual(batch.addresses('P2PKH'), xpub.address_range(0, 40, 'P2PKH'))
+        self.assertEqual(batch.public_key(7), xpub.child(7).key.encode(compressed=True))
+
+        view = batch[10:20]
+        self.assertEqual(view.addresses(), addresses[10:20])
+        self.assertEqual(list(view.indexes), list(range(10, 20)))
+        self.assertEqual(len(view.public_keys), 10 * 33)
+        self.assertEqual(batch[::3].addresses(), addresses[::3])
+
+        fp = io.BytesIO()
+        batch.write(fp)
+        restored = AddressBatch.from_buffer(fp.getbuffer())
+        self.assertEqual((restored.path, restored.addresses()), ('M/84h/0h/0h/0', addresses))
+        self.assertEqual(AddressBatch.from_buffer(view.to_bytes()).addresses(), addresses[10:20])
+
+
+class TestBackends(TestCase):
+    # https://github.com/bitcoin/bips/blob/master/bip-0032.mediawiki#test-vector-1
+    BIP32_VECTOR = [
+        ("m", 'xpub661MyMwAqRbcFtXgS5sYJABqqG9YLmC4Q1Rdap9gSE8NqtwybGhePY2gZ29ESFjqJoCu1Rupje8YtGqsefD265TMg7usUDFdp6W1EGMcet8',
+         'xprv9s21ZrQH143K3QTDL4LXw2F7HEK3wJUD2nW2nRk4stbPy6cq3jPPqjiChkVvvNKmPGJxWUtg6LnF5kejMRNNU3TGtRBeJgk33yuGBxrMPHi'),
+        ("m/0'", 'xpub68Gmy5EdvgibQVfPdqkBBCHxA5htiqg55crXYuXoQRKfDBFA1WEjWgP6LHhwBZeNK1VTsfTFUHCdrfp1bgwQ9xv5ski8PX9rL2dZXvgGDnw',
+         'xprv9uHRZZhk6KAJC1avXpDAp4MDc3sQKNxDiPvvkX8Br5ngLNv1TxvUxt4cV1rGL5hj6KCesnDYUhd7oWgT11eZG7XnxHrnYeSvkzY7d2bhkJ7'),
+        ("m/0'/1", 'xpub6ASuArnXKPbfEwhqN6e3mwBcDTgzisQN1wXN9BJcM47sSikHjJf3UFHKkNAWbWMiGj7Wf5uMash7SyYq527Hqck2AxYysAA7xmALppuCkwQ',
+         'xprv9wTYmMFdV23N2TdNG573QoEsfRrWKQgWeibmLntzniatZvR9BmLnvSxqu53Kw1UmYPxLgboyZQaXwTCg8MSY3H2EU4pWcQDnRnrVA1xe8fs'),
+        ("m/0'/1/2'", 'xpub6D4BDPcP2GT577Vvch3R8wDkScZWzQzMMUm3PWbmWvVJrZwQY4VUNgqFJPMM3No2dFDFGTsxxpG5uJh7n7epu4trkrX7x7DogT5Uv6fcLW5',
+         'xprv9z4pot5VBttmtdRTWfWQmoH1taj2axGVzFqSb8C9xaxKymcFzXBDptWmT7FwuEzG3ryjH4ktypQSAewRiNMjANTtpgP4mLTj34bhnZX7UiM'),
+        ("m/0'/1/2'/2", 'xpub6FHa3pjLCk84BayeJxFW2SP4XRrFd1JYnxeLeU8EqN3vDfZmbqBqaGJAyiLjTAwm6ZLRQUMv1ZACTj37sR62cfN7fe5JnJ7dh8zL4fiyLHV',
+         'xprvA2JDeKCSNNZky6uBCviVfJSKyQ1mDYahRjijr5idH2WwLsEd4Hsb2Tyh8RfQMuPh7f7RtyzTtdrbdqqsunu5Mm3wDvUAKRHSC34sJ7in334'),
+        ("m/0'/1/2'/2/1000000000", 'xpub6H1LXWLaKsWFhvm6RVpEL9P4KfRZSW7abD2ttkWP3SSQvnyA8FSVqNTEcYFgJS2UaFcxupHiYkro49S8yGasTvXEYBVPamhGW6cFJodrTHy',
+         'xprvA41z7zogVVwxVSgdKUHDy1SKmdb533PjDz7J6N6mV6uS3ze1ai8FHa8kmHScGpWmj4WggLyQjgPie1rFSruoUihUZREPSL39UNdE3BBDu76'),
+    ]
+
+    def test_parity(self):
+        import hashlib
+        from hdtools import backends
+
+        names = backends.available_backends()
+        self.assertIn('python', names)
+        self.assertIn('ecdsa', names)
+        digest = hashlib.sha256(b'hdtools').digest()
+
+        signatures = set()
+        for name in names:
+            with backends.using(name), self.subTest(backend=name):
+                M = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+                for path, xpub, xprv in self.BIP32_VECTOR:
+                    node = M.derive(path, cache=None)
+                    self.assertEqual(node.encode().decode(), xprv)
+                    self.assertEqual(node.to_xpub().encode().decode(), xpub)
+                    self.assertEqual(XPub.decode(xpub).derive_range(0, 2)[1].encode(), node.to_xpub().child(1).encode())
+
+                backend = backends.current()
+                point = backend.mul_base(0xdeadbeef)
+                self.assertEqual(backend.decompress(point[0], point[1] & 1), point)
+                self.assertIsNone(backend.decompress(0, False))
+                self.assertIsNone(backend.tweak_add(backend.mul_base(5), secp256k1.N - 5))
+
+                r, s = backend.sign(0xdeadbeef, digest)
+                signatures.add((r, s))
+                self.assertLessEqual(s, secp256k1.N // 2)
+                self.assertTrue(backend.verify(point, digest, r, s))
+                self.assertTrue(backend.verify(point, digest, r, secp256k1.N - s))
+                self.assertFalse(backend.verify(point, digest, r, s - 1))
+        self.assertEqual(len(signatures), 1)
+
+    def test_using_is_local(self):
+        import threading
+        from hdtools import backends
+
+        default = backends.current()
+        other = next(name for name in backends.available_backends() if name != default.name)
+        seen = []
+        with backends.using(other):
+            thread = threading.Thread(target=lambda: seen.append(backends.current()))
+            thread.start()
+            thread.join()
+            self.assertEqual(backends.current().name, other)
+        self.assertEqual(seen, [default])
+        self.assertIs(backends.current(), default)
+
+
+class TestParallel(TestCase):
+    def test_generate_addresses(self):
+        from hdtools.parallel import generate_addresses
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f', address_type='P2WPKH') / 84. / 0. / 0.
+        expected = (account / 1).to_xpub().address_range(3, 7)
+        self.assertEqual(generate_addresses(account, 1, 3, 7, workers=2, chunk_size=2), expected)
+        self.assertEqual(generate_addresses(account.to_xpub(), 1, 3, 7, workers=1), expected)
+        self.assertEqual(
+            generate_addresses(account / 1, None, 3, 7, 'P2PKH', workers=2, chunk_size=3),
+            (account / 1).address_range(3, 7, 'P2PKH')
+        )
+
+    def test_masters_from_mnemonics(self):
+        from hdtools.parallel import masters_from_mnemonics
+
+        mnemonic = 'lemon child success once board usual cigar buffalo video cheese kitten onion build axis dose'
+        pairs = [(mnemonic, ''), (mnemonic, 'TREZOR'), (mnemonic, '')]
+        masters = masters_from_mnemonics(pairs, workers=2, chunk_size=1)
+        self.assertEqual([master.encode() for master in masters],
+                         [XPrv.from_mnemonic(mnemonic, passphrase).encode() for mnemonic, passphrase in pairs])
+        self.assertEqual(masters[0].encode(), masters_from_mnemonics(pairs[:1], workers=1)[0].encode())
+
+    def test_verify_many(self):
+        import hashlib
+        from hdtools.parallel import verify_many
+
+        key = PrivateKey(hashlib.sha256(b'key').digest())
+        digests = [hashlib.sha256(bytes([i])).digest() for i in range(5)]
+        items = [(key.to_public(), digest, sig) for digest, sig in zip(digests, key.sign_many(digests))]
+        items[1] = (items[1][0], digests[0], items[1][2])  # wrong digest
+        items[3] = (items[3][0], items[3][1], b'\x30' + items[3][2][1:-1])  # malformed signature
+        items.append((b'\x02' + bytes(32), digests[0], items[0][2]))  # invalid public key
+        items.append((items[0][0], digests[0] * 2, items[0][2]))  # 64-byte digest
+        expected = [True, False, True, False, True, False, False]
+        self.assertEqual(verify_many(items, workers=1), expected)
+        self.assertEqual(verify_many(items, workers=2, chunk_size=2), expected)
+
+
+class TestAio(TestCase):
+    def test_deriver(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from hdtools.aio import Deriver
+        from hdtools.extended_keys import KeyDerivationError
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f', address_type='P2WPKH') / 84. / 0. / 0.
+        xpub = (account / 0).to_xpub()
+
+        async def main():
+            with ThreadPoolExecutor(2) as executor:
+                async with Deriver(executor, workers=2, max_pending=8, chunk_size=7) as deriver:
+                    addresses = await asyncio.gather(*(deriver.address(xpub, i % 20) for i in range(40)))
+                    hardened = await asyncio.gather(deriver.child(xpub, 2 ** 31), deriver.child(xpub, 1),
+                                                    return_exceptions=True)
+                    address_range = await deriver.address_range(xpub, 3, 20, 'P2PKH')
+                    child = await deriver.child(account, 2 ** 31 + 1)
+                    decoded = await deriver.decode(xpub.encode())
+                    return addresses, hardened, address_range, child, decoded, deriver.stats()
+
+        addresses, hardened, address_range, child, decoded, stats = asyncio.run(main())
+        self.assertEqual(addresses, xpub.address_range(0, 20) * 2)
+        self.assertIsInstance(hardened[0], KeyDerivationError)
+        self.assertEqual(hardened[1].encode(), xpub.child(1).encode())
+        self.assertEqual(address_range, xpub.address_range(3, 20, 'P2PKH'))
+        self.assertEqual(child.encode(), account.child(2 ** 31 + 1).encode())
+        self.assertEqual(decoded.encode(), xpub.encode())
+        self.assertLess(stats['jobs'], stats['requests'])  # concurrent requests for one parent are coalesced
+
+        forged = XPub(PrivateKey.from_int(7).to_public(), xpub.code, depth=xpub.depth, i=xpub.i,
+                      parent=xpub.parent, path=xpub.path, address_type=xpub.type.value)
+
+        async def same_chain_code():
+            async with Deriver(workers=1) as deriver:
+                return await asyncio.gather(deriver.address(forged, 0), deriver.address(xpub, 1))
+
+        self.assertEqual(asyncio.run(same_chain_code()), [forged.child(0).address(), xpub.child(1).address()])
+
+    def test_default_deriver(self):
+        import asyncio
+        import gc
+        import weakref
+        from hdtools import aio
+
+        xpub = XPrv.from_seed('000102030405060708090a0b0c0d0e0f').to_xpub()
+        loops = []
+
+        async def main():
+            loops.append(weakref.ref(asyncio.get_running_loop()))
+            return await aio.address(xpub, 3)
+
+        self.assertEqual(asyncio.run(main()), xpub.child(3).address())
+        gc.collect()
+        self.assertIsNone(loops[0]())  # the loop and its deriver are released once the loop is done
+
+
+class TestServer(TestCase):
+    def test_client(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from hdtools.server import Client, ServerError, Service, make_server
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f', address_type='P2WPKH') / 84. / 0. / 0.
+        xpub = account.to_xpub()
+        with ThreadPoolExecutor(2) as executor:
+            service = Service(executor, chunk_size=4)
+            server = make_server(service, port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                with Client(port=server.server_address[1]) as client:
+                    derived = client.derive(xpub.encode().decode(), '0/5')
+                    self.assertEqual(derived['xkey'].encode(), xpub.derive('0/5').encode())
+                    self.assertEqual(derived['address'], xpub.derive('0/5').address())
+                    self.assertEqual(client.addresses(account.encode().decode(), 3, 10, path='1'),
+                                     (xpub / 1).address_range(3, 10))
+                    self.assertEqual(client.decode(xpub.encode().decode())['depth'], 3)
+                    self.assertTrue(client.validate(derived['address'])['valid'])
+                    self.assertFalse(client.validate(derived['address'][:-1] + 'q')['valid'])
+                    with self.assertRaises(ServerError):
+                        client.derive(xpub.encode().decode(), "0'")
+                    self.assertEqual(client.stats()['key_cache']['misses'], 2)
+                    self.assertEqual(client.connects, 1)  # every request used the same connection
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_errors(self):
+        import http.client
+        import json
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from hdtools.server import Service, make_server
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f') / 44. / 0. / 0.
+        xprv, xpub = account.encode().decode(), account.to_xpub().encode().decode()
+        executor = ThreadPoolExecutor(1)
+        service = Service(executor)
+
+        def handle(method, **params):
+            return service.handle(method, json.dumps(params).encode())
+
+        self.assertEqual(handle('derive', xkey=xprv, path='0/1')[0], 200)
+        self.assertEqual(handle('decode', xkey=xprv)[0], 200)
+        self.assertEqual(service.stats()['node_cache']['size'], 0)  # private keys and nodes are not cached
+        self.assertEqual(service.stats()['key_cache']['size'], 0)
+        self.assertEqual(handle('derive', xkey=xpub, path='0/1')[0], 200)
+        self.assertEqual(service.stats()['node_cache']['size'], 1)
+        self.assertEqual(service.stats()['key_cache']['size'], 1)
+
+        self.assertEqual(handle('validate', address=5), (200, {'valid': False, 'error': 'address must be a string'}))
+        self.assertFalse(handle('validate', xkey=[xpub])[1]['valid'])
+        self.assertFalse(handle('validate', address='1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2', network=5)[1]['valid'])
+        self.assertEqual(handle('derive', xkey=xpub, path=5), (400, {'error': 'path must be a string'}))
+        self.assertEqual(handle('derive', xkey=xpub, path='0', address_type=5)[0], 400)
+        self.assertEqual(handle('addresses', xkey=xpub, start=0, count=1, path=[0])[0], 400)
+        for start, count in ((-1, 2), (True, 2), (0, False), (0, 2.0)):
+            self.assertEqual(handle('addresses', xkey=xpub, start=start, count=count)[0], 400)
+        executor.shutdown()
+        status, response = handle('addresses', xkey=xpub, start=0, count=2)
+        self.assertEqual(status, 500)
+        self.assertIn('RuntimeError', response['error'])
+
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            for length in ('abc', '-1'):
+                connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+                connection.putrequest('POST', '/decode')
+                connection.putheader('Content-Length', length)
+                connection.endheaders()
+                response = connection.getresponse()
+                self.assertEqual((response.status, json.loads(response.read())),
+                                 (400, {'error': 'Invalid Content-Length'}))
+                connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_in_flight(self):
+        import threading
+        import time
+        from hdtools.server import InFlight
+
+        inflight, started, release, calls = InFlight(), threading.Event(), threading.Event(), []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        results = []
+        owner = threading.Thread(target=lambda: results.append(inflight.run('key', work)))
+        owner.start()
+        started.wait()
+        waiter = threading.Thread(target=lambda: results.append(inflight.run('key', work)))
+        waiter.start()
+        while not inflight.coalesced:
+            time.sleep(0.001)
+        release.set()
+        owner.join()
+        waiter.join()
+        self.assertEqual((results, len(calls), inflight.coalesced), (['result', 'result'], 1, 1))
+
+
+class TestSeed(TestCase):
+    def test_mnemonic_to_seed(self):
+        from hdtools.seed import SeedCache, mnemonic_to_seed
+
+        mnemonic = 'lemon child success once board usual cigar buffalo video cheese kitten onion build axis dose'
+        try:
+            from mnemonic import Mnemonic  # pip install hdtools[tests]
+        except ImportError:
+            pass
+        else:
+            for passphrase in ('', 'TREZOR', 'p\u00e4ssw\u00f6rd'):
+                self.assertEqual(mnemonic_to_seed(mnemonic, passphrase), Mnemonic.to_seed(mnemonic, passphrase))
+
+        cache = SeedCache(max_size=1)
+        seed = mnemonic_to_seed(mnemonic, cache=cache)
+        self.assertEqual(mnemonic_to_seed(mnemonic, cache=cache), seed)
+        self.assertEqual(cache.get(mnemonic), seed)
+        mnemonic_to_seed(mnemonic, 'other', cache=cache)
+        self.assertIsNone(cache.get(mnemonic))  # evicted
+        self.assertEqual(cache.get(mnemonic, 'other'), mnemonic_to_seed(mnemonic, 'other'))
+        self.assertEqual(cache.stats(), {'size': 1, 'max_size': 1, 'hits': 3, 'misses': 3})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestBench(TestCase):
+    def test_run_all(self):
+        from hdtools.bench import baseline, compare, run_all
+
+        results = run_all(['base58check', 'XPub.child'], sizes=(1, 3))
+        self.assertEqual([(result['name'], result['size']) for result in results], [
+            ('XPub.child', 1), ('XPub.child', 3),
+            ('base58check encode', 1), ('base58check encode', 3),
+            ('base58check decode', 1), ('base58check decode', 3),
+        ])
+        self.assertTrue(all(result['ops_per_sec'] > 0 and result['peak_kib'] is not None for result in results))
+        self.assertEqual(set(compare(results[:2], baseline(results)).values()), {1.0})
+
+    def test_lazy_imports(self):
+        from hdtools.bench import eager_dependencies
+
+        self.assertEqual(eager_dependencies('hdtools.extended_keys'), [])
+
+
+class TestInstrument(TestCase):
+    def test_instrumented(self):
+        from hdtools import instrument, crypto_utils, extended_keys
+
+        exported = []
+        instrument.add_exporter(exported.append)
+        try:
+            master = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+            with instrument.instrumented(export_on_exit=True) as stats:
+                self.assertTrue(instrument.is_enabled())
+                (master / 44. / 0. / 0. / 0 / 5).address()
+        finally:
+            instrument.remove_exporter(exported.append)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['hmac_sha512']['count'], 5)
+        self.assertEqual(snapshot['address.render']['count'], 1)
+        self.assertEqual(exported, [snapshot])
+        self.assertFalse(instrument.is_enabled())
+        self.assertIs(extended_keys.hmac_sha512, crypto_utils.hmac_sha512)
+        self.assertFalse(hasattr(crypto_utils.hmac_sha512, '__wrapped_metric__'))
+
+    def test_lazy_imports_restored(self):
+        import subprocess
+        import sys
+
+        code = """
+import sys
+from hdtools import crypto_utils, instrument
+from hdtools.extended_keys import XPrv
+assert 'hdtools.address' not in sys.modules
+node = XPrv.from_seed('000102030405060708090a0b0c0d0e0f') / 0
+with instrument.instrumented():
+    node.address()  # imports hdtools.address while the probes are installed
+from hdtools import address
+assert address.hash160 is crypto_utils.hash160, address.hash160
+before = instrument.snapshot()
+node.address()
+assert instrument.snapshot() == before, instrument.snapshot()
+"""
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+
+class TestScanner(TestCase):
+    def test_scan(self):
+        from hdtools.scanner import scan_account, scan_accounts, scan_chain
+
+        M = XPrv.from_seed('000102030405060708090a0b0c0d0e0f')
+        account = M.derive("m/84'/0'/0'")
+        receive = (account / 0).to_xpub().address_range(0, 30, 'P2WPKH')
+        change = (account / 1).to_xpub().address_range(0, 5, 'P2WPKH')
+        used = {receive[2], receive[7], receive[25], change[0]}
+
+        scan = scan_chain(account, 0, used, gap_limit=10, batch_size=4, address_type='P2WPKH')
+        self.assertEqual(scan.used, [(2, receive[2]), (7, receive[7])])
+        self.assertEqual((scan.scanned, scan.next_unused), (18, 8))
+
+        scan = scan_chain(account.to_xpub(), 0, used.__contains__, gap_limit=20, address_type='P2WPKH')
+        self.assertEqual(scan.last_used, 25)
+
+        def oracle(addresses):
+            return [address in used for address in addresses]
+
+        scans = scan_account(account, oracle, batch=True, gap_limit=20, address_type='P2WPKH')
+        self.assertEqual(scans[1].used, [(0, change[0])])
+
+        accounts = scan_accounts(M, used, purpose=84, gap_limit=20)
+        self.assertEqual(len(accounts), 1)
+        self.assertEqual(accounts[0][0].last_used, 25)
+
+
+class TestIndex(TestCase):
+    def test_lookup(self):
+        import os
+        import tempfile
+        from hdtools.index import AddressIndex, IndexEntry
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f', address_type='P2WPKH').derive("m/84'/0'/0'")
+        xpub = account.to_xpub().encode().decode()
+        child = (account / 1 / 4).to_xpub()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.db')
+            with AddressIndex(path) as index:
+                self.assertEqual(index.extend(account, 1, 3), 3)
+                self.assertEqual(index.extend(account.to_xpub(), 1, 3), 6)
+                index.add(account, 0, 0, 2)
+                self.assertEqual(len(index), 8)
+
+            with AddressIndex(path) as index:
+                expected = IndexEntry(xpub, 1, 4)
+                for address_type in ('P2PKH', 'P2WPKH-P2SH', 'P2WPKH'):
+                    self.assertEqual(index.lookup(child.address(address_type)), expected)
+                self.assertEqual(index.lookup_hash(child.id()).path, 'M/1/4')
+                self.assertIsNone(index.lookup((account / 1 / 6).address()))
+                self.assertEqual(index.next_index(account, 0), 2)
+
+                foreign = [
+                    'bc1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3qccfmv3',  # P2WSH
+                    'bc1p5cyxnuxmeuwuvkwfem96lqzszd02n6xdcjrs20cac6yqjjwudpxqkedrcr',  # taproot
+                    'not an address', b'\xff',
+                ]
+                self.assertEqual(index.lookup_many(foreign + [child.address()]), [None] * 4 + [expected])
+                self.assertEqual(index.next_index(account / 1., 0), 0)
+                self.assertEqual(index.connection.execute('SELECT COUNT(*) FROM xkeys').fetchone()[0], 1)
+
+
+class TestFilters(TestCase):
+    def test_bloom_filter(self):
+        import os
+        from hdtools.filters import BloomFilter, public_key_hashes
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f').derive("m/84'/0'/0'")
+        bloom = BloomFilter.from_xkey(account, 0, 0, 50, fp_rate=0.01)
+        self.assertEqual(len(bloom), 100)
+
+        watched = public_key_hashes((account / 0 / 42).key.to_public())
+        self.assertEqual(bloom.contains_many(watched), [True, True])
+        self.assertNotIn(public_key_hashes((account / 0 / 50).key.to_public())[0], bloom)
+
+        bloom.add(b'\x01' * 32)  # witness program
+        others = [os.urandom(20) for _ in range(1000)]
+        self.assertLess(sum(bloom.contains_many(others)), 50)
+
+        restored = BloomFilter.from_bytes(bloom.to_bytes())
+        self.assertIn(b'\x01' * 32, restored)
+        self.assertEqual(restored.contains_many(others), bloom.contains_many(others))
+        self.assertEqual(bloom.contains_many(others[:100] + watched), [item in bloom for item in others[:100] + watched])
+        with self.assertRaises(AssertionError):
+            BloomFilter(10, fp_rate=1e-80)  # 266 hash functions do not fit the serialized u8
+
+
+class TestExport(TestCase):
+    def test_export(self):
+        import io
+        import json
+        from hdtools.export import export_addresses, iter_addresses, read_binary
+
+        account = XPrv.from_seed('000102030405060708090a0b0c0d0e0f').derive("m/84'/0'/0'")
+        types = ['P2PKH', 'P2WPKH-P2SH', 'P2WPKH']
+        rows = list(iter_addresses(account, 0, 3, 8, types, chunk_size=2))
+        self.assertEqual(rows[0], (3,) + tuple((account / 0 / 3).address(address_type) for address_type in types))
+        self.assertEqual([row[0] for row in rows], list(range(3, 8)))
+
+        fp = io.StringIO()
+        self.assertEqual(export_addresses(account, 0, 3, 8, fp, 'csv', types, buffer_size=64), 5)
+        lines = fp.getvalue().splitlines()
+        self.assertEqual(lines[0], 'index,P2PKH,P2WPKH-P2SH,P2WPKH')
+        self.assertEqual(lines[1:], [','.join(map(str, row)) for row in rows])
+
+        fp = io.StringIO()
+        export_addresses(account, 0, 3, 8, fp, 'ndjson', types)
+        self.assertEqual(json.loads(fp.getvalue().splitlines()[-1])['P2WPKH'], rows[-1][3])
+
+        fp = io.BytesIO()
+        export_addresses(account, 0, 3, 8, fp, 'binary', types, buffer_size=100)
+        fp.seek(0)
+        self.assertEqual(list(read_binary(fp, buffer_size=100)), rows)
+
+
+class TestBech32(TestCase):
+    def test_against_reference(self):
+        import os
+        import random
+        from hdtools import bech32, bech32_fast
+
+        def outcome(codec, *args, method='decode'):
+            try:
+                result = getattr(codec, method)(*args)
+            except bech32.Bech32DecodeError as e:
+                return 'error', str(e)
+            return result if method == 'encode' else (result[0], bytes(result[1]))
+
+        rng = random.Random(0)
+        for length in (0, 1, 2, 20, 31, 32, 40, 41):
+            for witver in (0, 1, 16):
+                program = os.urandom(length)
+                address = bech32_fast.encode('bc', witver, program)
+                self.assertEqual(address, bech32.encode('bc', witver, list(program)))
+
+                candidates = [address, address.upper(), address[:-1] + 'q', address[:-7], address[:2] + 'C' + address[3:],
+                              address.replace('1', '', 1), address[:-1] + 'b', address + 'q' * 60]
+                candidates += [address[:i] + rng.choice(bech32.CHARSET) + address[i + 1:] for i in range(3, len(address))]
+                for candidate in candidates:
+                    self.assertEqual(outcome(bech32_fast, 'bc', candidate), outcome(bech32, 'bc', candidate))
+
+        programs = [(0, os.urandom(20)) for _ in range(5)]
+        addresses = bech32_fast.encode_many('tb', programs)
+        self.assertEqual(addresses, [bech32.encode('tb', v, list(p)) for v, p in programs])
+        self.assertEqual(bech32_fast.decode_many('tb', addresses), programs)
+
 
 if __name__ == '__main__':
     test_main()
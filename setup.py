@@ -17,12 +17,15 @@ setup(
     packages=[
         'hdtools',
     ],
+    python_requires='>=3.7',
     keywords=["bip32", 'hd-wallet', 'bitcoin', 'bip49', 'bip44'],
     install_requires=[
         'ecdsa',
-        'base58',
-        'mnemonic'
     ],
+    extras_require={
+        'libsecp256k1': ['coincurve'],
+        'tests': ['mnemonic'],  # reference BIP39 implementation the seeds are checked against
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -31,8 +34,11 @@ setup(
 
         # Python versions
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
 )